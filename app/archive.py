@@ -0,0 +1,36 @@
+import argparse
+from datetime import datetime, timedelta
+from . import crud, database, models
+
+# Перенесення старих транзакцій в архів:
+#   python -m app.archive --days 365
+# Заодно дочищає акаунти, видалення яких перервалося (--skip-purge — ні).
+# Запускати періодично (cron); повторний запуск безпечний.
+
+ARCHIVE_AFTER_DAYS = 365
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old transactions into the archive table")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="archive transactions older than this many days")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--skip-purge", action="store_true",
+                        help="do not purge accounts whose deletion was interrupted")
+    args = parser.parse_args(argv)
+
+    models.Base.metadata.create_all(bind=database.engine)
+    cutoff = datetime.utcnow() - timedelta(days=args.days)
+    db = database.SessionLocal()
+    try:
+        purged = 0 if args.skip_purge else crud.purge_deleted_users(db)
+        moved = crud.archive_transactions(db, cutoff, args.batch_size)
+    finally:
+        db.close()
+    if purged:
+        print(f"Purged {purged} deleted accounts")
+    print(f"Archived {moved} transactions older than {cutoff:%Y-%m-%d}")
+
+
+if __name__ == "__main__":
+    main()
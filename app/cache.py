@@ -0,0 +1,54 @@
+from threading import Lock
+from time import monotonic
+from typing import Any, Optional
+
+
+# Простий in-process кеш, розкладений по користувачах.
+# Інвалідація — цілим користувачем: crud-функції викликають invalidate(user_id)
+# після будь-якої зміни, від якої залежать закешовані значення.
+# ttl (секунди) обмежує застарілість, коли дані змінює інший воркер.
+class UserCache:
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self._data: dict[int, dict[Any, tuple[Optional[float], Any]]] = {}
+        self._lock = Lock()
+
+    def get(self, user_id: int, key: Any = None) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(user_id, {}).get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < monotonic():
+                del self._data[user_id][key]
+                return None
+            return value
+
+    def set(self, user_id: int, value: Any, key: Any = None) -> None:
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data.setdefault(user_id, {})[key] = (expires, value)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class OwnedCategories:
+    __slots__ = ("ids", "uncategorized_id", "version")
+
+    def __init__(self, ids: frozenset[int], uncategorized_id: Optional[int], version: int):
+        self.ids = ids
+        self.uncategorized_id = uncategorized_id
+        self.version = version  # версія категорій у журналі змін, з якої зібрано ids
+
+
+# user_id -> OwnedCategories (id категорій користувача + id "Uncategorized")
+owned_categories = UserCache()
+
+# user_id -> {(group_by, top): (версія бібліотек у журналі змін, LibraryStats)}
+library_stats = UserCache()
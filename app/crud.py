@@ -1,13 +1,46 @@
+import heapq
+from collections import defaultdict
+from functools import lru_cache
 from datetime import datetime, timezone
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from . import models, schemas, security
-from typing import Optional
-from sqlalchemy import func
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session, load_only
+from . import models, schemas, security, cache, events, database, readmodel, responsecache
+from typing import Any, Optional
+from sqlalchemy import func, select, insert, delete, case, and_, literal_column, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from .schemas import TransactionFilter
+
+# ---- Sparse fieldsets (?fields=id,title,amount) ----
+# id повертається завжди; невідоме поле — 400
+def parse_fields(schema: type, fields: Optional[str]) -> Optional[list[str]]:
+    if fields is None:
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in schema.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(["id", *requested]))
+
+# Колонки моделі для load_only: вибрані поля (без зв'язків) + службові
+def _columns(model, fields: list[str], *required: str) -> list:
+    names = dict.fromkeys([*fields, *required])
+    return [getattr(model, name) for name in names if name in model.__table__.c]
+
+def project(rows, fields: list[str]) -> list[dict]:
+    return [{name: getattr(row, name) for name in fields} for row in rows]
+
+# Гарячі запити — готові statement'и з bindparam: будуються один раз (константи модуля
+# або lru_cache за "формою" запиту), тож на виклик не повторюються побудова запиту
+# і обчислення cache key, а скомпільований SQL береться з кешу engine.
+# lambda_stmt тут повільніший за звичайний db.query (див. benchmarks/bench_statements.py).
+STATEMENT_CACHE_SIZE = 256
+
+USER_BY_EMAIL = select(models.User).where(models.User.email == bindparam("email")).limit(1)
+
 # Users
 def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
-    return db.query(models.User).filter(models.User.email == email).first()
+    return db.execute(USER_BY_EMAIL, {"email": email}).scalars().first()
 
 # Get all users
 def get_users(db: Session, skip: int = 0, limit: int = 100):
@@ -15,7 +48,7 @@ def get_users(db: Session, skip: int = 0, limit: int = 100):
 
 # Get single user by ID
 def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return db.get(models.User, user_id)
 
 # Update user
 def update_user(db: Session, user_id: int, user_in: schemas.UserUpdate):
@@ -36,11 +69,82 @@ def update_user(db: Session, user_id: int, user_in: schemas.UserUpdate):
     return user
 
 # Delete user
+
+# Усі таблиці з даними користувача (з колонкою user_id), які чистяться при видаленні акаунта
+USER_DATA_MODELS = [
+    models.Transaction,
+    models.ArchivedTransaction,
+    models.Category,
+    models.Library,
+    models.ChangeLog,
+    models.BalanceCheckpoint,
+    models.ArchiveState,
+    models.Budget,
+    models.CategoryMonthSpend,
+]
+PURGE_CHUNK_SIZE = 5000
+
+# Позначити акаунт видаленим: вхід і токени перестають працювати одразу,
+# email звільняється для повторної реєстрації
+def mark_user_deleted(db: Session, user_id: int) -> bool:
+    updated = db.query(models.User).filter(
+        models.User.id == user_id,
+        models.User.deleted_at.is_(None)
+    ).update({
+        models.User.deleted_at: datetime.utcnow(),
+        models.User.email: f"deleted+{user_id}@deleted.invalid",
+    }, synchronize_session=False)
+    db.commit()
+    cache.owned_categories.invalidate(user_id)
+    cache.library_stats.invalidate(user_id)
+    readmodel.store.evict(user_id)
+    return bool(updated)
+
+# Видалити дані користувача bulk DELETE'ами пакетами по chunk_size рядків,
+# з комітом після кожного, щоб не тримати write-lock SQLite довго.
+# ORM-каскад не використовується: він вантажив би всі рядки в пам'ять.
+def purge_user(db: Session, user_id: int, chunk_size: int = PURGE_CHUNK_SIZE) -> None:
+    for model in USER_DATA_MODELS:
+        if "id" not in model.__table__.c:
+            db.execute(delete(model).where(model.user_id == user_id))
+            db.commit()
+            continue
+        while True:
+            chunk = select(model.id).where(model.user_id == user_id).limit(chunk_size)
+            result = db.execute(delete(model).where(model.id.in_(chunk)))
+            db.commit()
+            if result.rowcount < chunk_size:
+                break
+    db.execute(delete(models.User).where(models.User.id == user_id))
+    db.commit()
+    responsecache.responses.invalidate(user_id)
+
+# Для BackgroundTasks: окрема сесія, бо сесія запиту вже закрита
+def purge_user_background(user_id: int) -> None:
+    db = database.SessionLocal()
+    try:
+        purge_user(db, user_id)
+    finally:
+        db.close()
+
+# Дочистити користувачів, позначених видаленими, чиє видалення перервалося
+# (перезапуск процесу під час/до фонової задачі). purge_user ідемпотентний.
+def purge_deleted_users(db: Session) -> int:
+    user_ids = db.execute(select(models.User.id).where(models.User.deleted_at.is_not(None))).scalars().all()
+    for user_id in user_ids:
+        purge_user(db, user_id)
+    return len(user_ids)
+
+def purge_deleted_users_background() -> None:
+    db = database.SessionLocal()
+    try:
+        purge_deleted_users(db)
+    finally:
+        db.close()
+
 def delete_user(db: Session, user_id: int):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        db.delete(user)
-        db.commit()
+    if mark_user_deleted(db, user_id):
+        purge_user(db, user_id)
 
 # СТВОРИТИ КОРИСТУВАЧА
 #"Uncategorized" category exists
@@ -64,6 +168,102 @@ def authenticate_user(db: Session, email: str, password: str) -> Optional[models
         return None
     return user
 
+# Change log / sync
+
+SYNC_ENTITIES = {
+    "transaction": models.Transaction,
+    "category": models.Category,
+    "library": models.Library,
+}
+SYNC_MAX_LIMIT = 5000
+
+# Записати зміну в журнал — викликати до db.commit(), щоб потрапила в ту саму транзакцію
+def log_change(db: Session, user_id: int, entity: str, entity_id: int, op: str) -> models.ChangeLog:
+    entry = models.ChangeLog(user_id=user_id, entity=entity, entity_id=entity_id, op=op)
+    db.add(entry)
+    return entry
+
+DATA_VERSION = select(func.max(models.ChangeLog.id)).where(models.ChangeLog.user_id == bindparam("user_id"))
+ENTITY_DATA_VERSION = DATA_VERSION.where(models.ChangeLog.entity == bindparam("entity"))
+
+# Версія даних користувача (усіх або лише однієї сутності) — id останнього запису журналу
+def get_data_version(db: Session, user_id: int, entity: Optional[str] = None) -> int:
+    if entity is None:
+        return db.execute(DATA_VERSION, {"user_id": user_id}).scalar() or 0
+    return db.execute(ENTITY_DATA_VERSION, {"user_id": user_id, "entity": entity}).scalar() or 0
+
+def _sync_payload(db: Session, user_id: int, ids: Optional[dict[str, set[int]]]) -> dict:
+    changes = {}
+    for entity, model in SYNC_ENTITIES.items():
+        query = db.query(model).filter(model.user_id == user_id)
+        if ids is not None:
+            if not ids[entity]:
+                changes[entity] = []
+                continue
+            query = query.filter(model.id.in_(ids[entity]))
+        changes[entity] = query.order_by(model.id).all()
+
+    # Транзакції могли вже переїхати в архів
+    archived = db.query(models.ArchivedTransaction).filter(models.ArchivedTransaction.user_id == user_id)
+    if ids is not None:
+        archived = archived.filter(models.ArchivedTransaction.id.in_(ids["transaction"])) if ids["transaction"] else None
+    if archived is not None:
+        changes["transaction"] = sorted(changes["transaction"] + archived.all(), key=lambda tx: tx.id)
+    return {
+        "transactions": changes["transaction"],
+        "categories": changes["category"],
+        "libraries": changes["library"],
+    }
+
+# ЗМІНИ З ВЕРСІЇ since: since=0 — повний знімок, інакше лише змінені рядки + tombstones
+def get_changes_since(db: Session, user_id: int, since: int = 0, limit: int = 1000) -> dict:
+    limit = max(1, min(limit, SYNC_MAX_LIMIT))
+
+    if since <= 0:
+        # Версію читаємо до знімка: зміни між ними прийдуть повторно, а не загубляться
+        version = get_data_version(db, user_id)
+        return {
+            "version": version,
+            "full": True,
+            "has_more": False,
+            "changes": _sync_payload(db, user_id, None),
+            "deleted": {"transactions": [], "categories": [], "libraries": []},
+        }
+
+    entries = db.query(models.ChangeLog).filter(
+        models.ChangeLog.user_id == user_id,
+        models.ChangeLog.id > since
+    ).order_by(models.ChangeLog.id).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Залишаємо лише останню операцію для кожного об'єкта
+    last_op: dict[tuple[str, int], str] = {}
+    for entry in entries:
+        last_op[(entry.entity, entry.entity_id)] = entry.op
+
+    changed = {entity: set() for entity in SYNC_ENTITIES}
+    deleted = {entity: [] for entity in SYNC_ENTITIES}
+    for (entity, entity_id), op in last_op.items():
+        if op == "delete":
+            deleted[entity].append(entity_id)
+        else:
+            changed[entity].add(entity_id)
+
+    # Рядок, видалений пізніше за цю сторінку, тут просто не знайдеться —
+    # його tombstone прийде на наступній сторінці
+    return {
+        "version": entries[-1].id if entries else since,
+        "full": False,
+        "has_more": has_more,
+        "changes": _sync_payload(db, user_id, changed),
+        "deleted": {
+            "transactions": sorted(deleted["transaction"]),
+            "categories": sorted(deleted["category"]),
+            "libraries": sorted(deleted["library"]),
+        },
+    }
+
 # Categories
 
 # СТВОРИТИ КАТЕГОРІЮ ДЛЯ ПОТОЧНОГО КОРИСТУВАЧА
@@ -92,48 +292,97 @@ def create_category(db: Session, user_id: int, cat_in: schemas.CategoryCreate) -
 
     db_cat = models.Category(name=cat_in.name, user_id=user_id, parent_id=cat_in.parent_id)
     db.add(db_cat)
+    db.flush()
+    log_change(db, user_id, "category", db_cat.id, "insert")
     db.commit()
+    cache.owned_categories.invalidate(user_id)
     db.refresh(db_cat)
     return db_cat
 
 # ПОКАЗАТИ УСІ КАТЕГОРІЇ ДЛЯ ПОТОЧНОГО КОРИСТУВАЧА
-# crud.py
-
-def get_user_categories(db: Session, user_id: int):
-    # Отримуємо кореневі категорії
-    root_categories = db.query(models.Category).filter(
-        models.Category.user_id == user_id,
-        models.Category.parent_id.is_(None)
-    ).all()
-
-    def build_tree(categories):
-        result = []
-        for cat in categories:
-            # Серіалізуємо категорію
-            serialized = schemas.CategoryRead.from_orm(cat)
-
-            # Отримуємо дочірні категорії
-            children = db.query(models.Category).filter(
-                models.Category.parent_id == cat.id
-            ).all()
-            serialized.children = build_tree(children)
-
-            # ДОДАЄМО ТРАНЗАКЦІЇ ЦІЄЇ КАТЕГОРІЇ
-            txs = db.query(models.Transaction).filter(
-                models.Transaction.category_id == cat.id
-            ).order_by(models.Transaction.date.desc()).all()
-
-            serialized.transactions = [
-                schemas.TransactionRead.from_orm(tx) for tx in txs
-            ]
-
-            result.append(serialized)
-        return result
-
-    return build_tree(root_categories)
+# Категорії й транзакції (включно з архівом) читаємо одним запитом кожні
+# і будуємо дерево в пам'яті, без запитів на кожен вузол
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _user_categories_stmt(fields: Optional[tuple[str, ...]]):
+    stmt = select(models.Category).where(models.Category.user_id == bindparam("user_id"))
+    if fields is not None:
+        stmt = stmt.options(load_only(*_columns(models.Category, fields, "parent_id")))
+    return stmt.order_by(models.Category.id)
+
+def get_user_categories(db: Session, user_id: int, fields: Optional[list[str]] = None):
+    stmt = _user_categories_stmt(tuple(fields) if fields is not None else None)
+    categories = db.execute(stmt, {"user_id": user_id}).scalars().all()
+
+    txs = []
+    if fields is None or "transactions" in fields:
+        params = {"user_id": user_id}
+        shape = frozenset(params)
+        txs = db.execute(_transactions_stmt(models.Transaction, shape), params).scalars().all()
+        if _archive_reached(get_archive_state(db, user_id)):
+            archived = db.execute(_transactions_stmt(models.ArchivedTransaction, shape), params).scalars().all()
+            txs = _merge_by_date(txs, archived)
+
+    txs_by_category = defaultdict(list)
+    for tx in txs:
+        txs_by_category[tx.category_id].append(schemas.TransactionRead.model_validate(tx))
+
+    children_by_parent = defaultdict(list)
+    for cat in categories:
+        children_by_parent[cat.parent_id].append(cat)
+
+    def build_tree(parent_id):
+        return [
+            schemas.CategoryRead(
+                id=cat.id,
+                name=cat.name,
+                user_id=cat.user_id,
+                parent_id=cat.parent_id,
+                created_at=cat.created_at,
+                children=build_tree(cat.id),
+                transactions=txs_by_category.get(cat.id, []),
+            )
+            for cat in children_by_parent.get(parent_id, [])
+        ]
+
+    # Sparse fieldset: вузли — dict лише з вибраних полів, children/transactions — за запитом
+    def build_projected(parent_id):
+        nodes = []
+        for cat in children_by_parent.get(parent_id, []):
+            node = {}
+            for name in fields:
+                if name == "children":
+                    node[name] = build_projected(cat.id)
+                elif name == "transactions":
+                    node[name] = txs_by_category.get(cat.id, [])
+                else:
+                    node[name] = getattr(cat, name)
+            nodes.append(node)
+        return nodes
+
+    return build_tree(None) if fields is None else build_projected(None)
+
+# Дерево категорій як готовий JSON зі спільного (між воркерами) кешу відповідей.
+# Версію читаємо ДО побудови дерева: дані можуть бути лише новішими за мітку,
+# тож у найгіршому разі запис зайвий раз перебудується, але не буде застарілим.
+JSON_ADAPTER = TypeAdapter(Any)
+
+def get_user_categories_json(db: Session, user_id: int, fields: Optional[list[str]] = None) -> bytes:
+    if not responsecache.ENABLED:
+        return JSON_ADAPTER.dump_json(get_user_categories(db, user_id, fields))
+    key = "categories" if fields is None else "categories?fields=" + ",".join(fields)
+    version = get_data_version(db, user_id)
+    body = responsecache.responses.get(user_id, key, version)
+    if body is None:
+        body = JSON_ADAPTER.dump_json(get_user_categories(db, user_id, fields))
+        responsecache.responses.put(user_id, key, version, body)
+    return body
+
+CATEGORY_BY_ID = select(models.Category).where(
+    models.Category.id == bindparam("category_id"), models.Category.user_id == bindparam("user_id")
+).limit(1)
 
 def get_category(db: Session, category_id: int, user_id: int) -> Optional[models.Category]:
-    return db.query(models.Category).filter(models.Category.id == category_id, models.Category.user_id == user_id).first()
+    return db.execute(CATEGORY_BY_ID, {"category_id": category_id, "user_id": user_id}).scalars().first()
     
 def update_category(db: Session, category_id: int, user_id: int, cat_in: schemas.CategoryUpdate) -> Optional[models.Category]:
     category = db.query(models.Category).filter(
@@ -179,7 +428,9 @@ def update_category(db: Session, category_id: int, user_id: int, cat_in: schemas
 
         category.parent_id = cat_in.parent_id if cat_in.parent_id != 0 else None
 
+    log_change(db, user_id, "category", category_id, "update")
     db.commit()
+    cache.owned_categories.invalidate(user_id)
     db.refresh(category)
     return category
 
@@ -194,6 +445,8 @@ def delete_category(db: Session, category_id: int, user_id: int) -> bool:
     # Перевіряємо, чи є транзакції
     has_transactions = db.query(models.Transaction).filter(
         models.Transaction.category_id == category_id
+    ).first() or db.query(models.ArchivedTransaction).filter(
+        models.ArchivedTransaction.category_id == category_id
     ).first()
     if has_transactions:
         raise HTTPException(status_code=400, detail="Cannot delete category with transactions")
@@ -209,8 +462,12 @@ def delete_category(db: Session, category_id: int, user_id: int) -> bool:
     if category.name == "Uncategorized":
         raise HTTPException(status_code=400, detail="Cannot delete default category")
 
+    for model in (models.Budget, models.CategoryMonthSpend):
+        db.query(model).filter(model.category_id == category_id).delete(synchronize_session=False)
     db.delete(category)
+    log_change(db, user_id, "category", category_id, "delete")
     db.commit()
+    cache.owned_categories.invalidate(user_id)
     return True
 
 # Transactions
@@ -225,10 +482,90 @@ def get_or_create_uncategorized(db: Session, user_id: int) -> models.Category:
     if not uncategorized:
         uncategorized = models.Category(name="Uncategorized", user_id=user_id)
         db.add(uncategorized)
+        db.flush()
+        log_change(db, user_id, "category", uncategorized.id, "insert")
         db.commit()
+        cache.owned_categories.invalidate(user_id)
         db.refresh(uncategorized)
     return uncategorized
 
+# Кеш id категорій користувача: перевірка належності category_id без завантаження категорій.
+# Запис валідний, доки збігається версія категорій у журналі змін — так видно і
+# створення, і видалення категорій в інших воркерах (один індексований запит замість списку).
+# Локальні crud-функції категорій додатково інвалідують його одразу.
+OWNED_CATEGORIES = select(models.Category.id, models.Category.name).where(
+    models.Category.user_id == bindparam("user_id")
+).order_by(models.Category.id)
+
+def get_owned_categories(db: Session, user_id: int) -> cache.OwnedCategories:
+    version = get_data_version(db, user_id, "category")
+    owned = cache.owned_categories.get(user_id)
+    if owned is None or owned.version != version:
+        rows = db.execute(OWNED_CATEGORIES, {"user_id": user_id}).all()
+        uncategorized_id = next((row.id for row in rows if row.name == "Uncategorized"), None)
+        owned = cache.OwnedCategories(frozenset(row.id for row in rows), uncategorized_id, version)
+        cache.owned_categories.set(user_id, owned)
+    return owned
+
+def user_owns_category(db: Session, user_id: int, category_id: int) -> bool:
+    return category_id in get_owned_categories(db, user_id).ids
+
+def get_uncategorized_id(db: Session, user_id: int) -> int:
+    uncategorized_id = get_owned_categories(db, user_id).uncategorized_id
+    if uncategorized_id is None:
+        uncategorized_id = get_or_create_uncategorized(db, user_id).id
+    return uncategorized_id
+
+# Push-подія для підписників /profile/stream; баланс рахуємо лише якщо хтось слухає
+def publish_transaction_event(db: Session, user_id: int, op: str, transaction_id: int, tx: Optional[models.Transaction] = None) -> None:
+    if not events.broker.has_subscribers(user_id):
+        return
+    event = {
+        "type": "transaction",
+        "op": op,
+        "id": transaction_id,
+        "balance": get_user_balance(db, user_id),
+    }
+    if tx is not None:
+        event.update(amount=tx.amount, category_id=tx.category_id, date=tx.date.isoformat() if tx.date else None)
+    events.broker.publish(user_id, event)
+
+# Write-through у read model (якщо користувач завантажений у пам'ять).
+# Якщо між версією моделі та цим записом були чужі зміни (інший воркер) — модель скидається.
+def sync_read_model(db: Session, user_id: int, version: int, row=None, deleted_id: Optional[int] = None) -> None:
+    if readmodel.store.version_of(user_id) is None:
+        return
+    previous = db.query(func.max(models.ChangeLog.id)).filter(
+        models.ChangeLog.user_id == user_id,
+        models.ChangeLog.entity == "transaction",
+        models.ChangeLog.id < version
+    ).scalar() or 0
+    readmodel.store.apply(user_id, previous, version, row=row, deleted_id=deleted_id)
+
+# Лише "гаряча" таблиця: архів читається SQL-ом і тільки коли діапазон його сягає
+def _load_read_model(db: Session, user_id: int, version: int) -> readmodel.UserTransactions:
+    rows = db.query(*[getattr(models.Transaction, name) for name in ARCHIVE_COLUMNS]).filter(
+        models.Transaction.user_id == user_id
+    ).all()
+    return readmodel.UserTransactions.build(user_id, version, rows)
+
+# Фільтрований список з read model; None — відповідати SQL-ом: модель вимкнена,
+# діапазон сягає архіву, користувач ще не "гарячий" або не вміщується в бюджет
+def _query_read_model(db: Session, user_id: int, filters: TransactionFilter, skip: int, limit: int):
+    if not readmodel.ENABLED:
+        return None
+    if _archive_reached(get_archive_state(db, user_id), filters.start_date):
+        return None
+    version = get_data_version(db, user_id, "transaction")
+    rows = readmodel.store.query(user_id, version, filters, skip, limit)
+    if rows is None:
+        if not readmodel.store.admit(user_id):
+            return None
+        if not readmodel.store.put(_load_read_model(db, user_id, version)):
+            return None
+        rows = readmodel.store.query(user_id, version, filters, skip, limit)
+    return rows
+
 def create_transaction(db: Session, user_id: int, tx_in: schemas.TransactionCreate) -> models.Transaction:
     data = tx_in.model_dump(exclude_unset=True)
 
@@ -236,92 +573,257 @@ def create_transaction(db: Session, user_id: int, tx_in: schemas.TransactionCrea
         data["date"] = datetime.now(timezone.utc)
 
     # Валідація category_id
-    category = None
-    if "category_id" in data and data["category_id"] is not None:
-        category = db.query(models.Category).filter(
-            models.Category.id == data["category_id"],
-            models.Category.user_id == user_id
-        ).first()
-        if not category:
+    if data.get("category_id") is not None:
+        if not user_owns_category(db, user_id, data["category_id"]):
             raise HTTPException(status_code=400, detail="Invalid category")
-
-    # Якщо категорія не вказана — використовуємо "Uncategorized"
-    if category is None:
-        category = get_or_create_uncategorized(db, user_id)
-        data["category_id"] = category.id
+    else:
+        # Якщо категорія не вказана — використовуємо "Uncategorized"
+        data["category_id"] = get_uncategorized_id(db, user_id)
 
     db_tx = models.Transaction(user_id=user_id, **data)
     db.add(db_tx)
+    db.flush()
+    shift_balance_checkpoints(db, user_id, db_tx.date, db_tx.amount)
+    track_category_spend(db, user_id, [(db_tx.category_id, db_tx.date, db_tx.amount, 1)])
+    entry = log_change(db, user_id, "transaction", db_tx.id, "insert")
+    db.flush()
+    version = entry.id
     db.commit()
     db.refresh(db_tx)
+    sync_read_model(db, user_id, version, row=db_tx)
+    publish_transaction_event(db, user_id, "insert", db_tx.id, db_tx)
     return db_tx
 
 def update_transaction(db: Session, transaction_id: int, user_id: int, tx_in: schemas.TransactionUpdate) -> Optional[models.Transaction]:
-    transaction = get_transaction(db, transaction_id, user_id)
+    transaction = get_transaction(db, transaction_id, user_id) or restore_archived_transaction(db, transaction_id, user_id)
     if not transaction:
         return None
 
     data = tx_in.model_dump(exclude_unset=True)
 
     if "category_id" in data and data["category_id"] is not None:
-        category = db.query(models.Category).filter(
-            models.Category.id == data["category_id"],
-            models.Category.user_id == user_id
-        ).first()
-        if not category:
-            raise HTTPException(status_code=400, detail="Category not found or not yours")
+        if not user_owns_category(db, user_id, data["category_id"]):
+            raise HTTPException(status_code=400, detail="Invalid category")
     elif "category_id" in data and data["category_id"] is None:
         # Дозволяємо встановити NULL → перемістити в "Uncategorized"
-        uncategorized = get_or_create_uncategorized(db, user_id)
-        data["category_id"] = uncategorized.id
+        data["category_id"] = get_uncategorized_id(db, user_id)
 
+    old_date, old_amount, old_category_id = transaction.date, transaction.amount, transaction.category_id
     for key, value in data.items():
         setattr(transaction, key, value)
-
+    if (transaction.date, transaction.amount) != (old_date, old_amount):
+        shift_balance_checkpoints(db, user_id, old_date, -old_amount)
+        shift_balance_checkpoints(db, user_id, transaction.date, transaction.amount)
+    if (transaction.date, transaction.amount, transaction.category_id) != (old_date, old_amount, old_category_id):
+        track_category_spend(db, user_id, [
+            (old_category_id, old_date, old_amount, -1),
+            (transaction.category_id, transaction.date, transaction.amount, 1),
+        ])
+
+    entry = log_change(db, user_id, "transaction", transaction_id, "update")
+    db.flush()
+    version = entry.id
     db.commit()
     db.refresh(transaction)
+    sync_read_model(db, user_id, version, row=transaction)
+    publish_transaction_event(db, user_id, "update", transaction_id, transaction)
     return transaction
 
 def delete_transaction(db: Session, transaction_id: int, user_id: int) -> bool:
-    transaction = get_transaction(db, transaction_id, user_id)
+    transaction = get_transaction(db, transaction_id, user_id) or restore_archived_transaction(db, transaction_id, user_id)
     if not transaction:
         return False
+    shift_balance_checkpoints(db, user_id, transaction.date, -transaction.amount)
+    track_category_spend(db, user_id, [(transaction.category_id, transaction.date, transaction.amount, -1)])
     db.delete(transaction)
+    entry = log_change(db, user_id, "transaction", transaction_id, "delete")
+    db.flush()
+    version = entry.id
     db.commit()
+    sync_read_model(db, user_id, version, deleted_id=transaction_id)
+    publish_transaction_event(db, user_id, "delete", transaction_id)
     return True
 
-# ПОКАЗАТИ УСІ ТРАНЗАКЦІЇ ПОТОЧНОГО КОРИСТУВАЧА
-def get_user_transactions(
-    db: Session,
-    user_id: int,
-    filters: TransactionFilter,
-    skip: int = 0,
-    limit: int = 100
-) -> list[models.Transaction]:
-    
-    query = db.query(models.Transaction).filter(models.Transaction.user_id == user_id)
+IMPORT_MAX_BATCH = 1000
+IMPORT_FIELDS = ("title", "amount", "category_id", "date", "notes")
+
+# ІМПОРТ ПАКЕТУ (банківська синхронізація): upsert за external_id одним INSERT ... ON CONFLICT.
+# Повторний імпорт того самого пакету нічого не змінює.
+def import_transactions(db: Session, user_id: int, items: list[schemas.TransactionImport]) -> dict:
+    if len(items) > IMPORT_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {IMPORT_MAX_BATCH} transactions")
+
+    # Дублікати в пакеті: перемагає останній
+    batch = {item.external_id: item for item in items}
+    # Належність категорій перевіряємо в пам'яті за одним знімком, Uncategorized — не більше одного разу
+    owned = get_owned_categories(db, user_id)
+    uncategorized_id = owned.uncategorized_id
+    rows = {}
+    for external_id, item in batch.items():
+        data = item.model_dump(include=set(IMPORT_FIELDS))
+        data["date"] = _naive(data["date"])
+        if data["category_id"] is None:
+            if uncategorized_id is None:
+                uncategorized_id = get_or_create_uncategorized(db, user_id).id
+            data["category_id"] = uncategorized_id
+        elif data["category_id"] not in owned.ids:
+            raise HTTPException(status_code=400, detail=f"Invalid category for external_id '{external_id}'")
+        rows[external_id] = data
+
+    existing = {
+        tx.external_id: tx
+        for model in (models.Transaction, models.ArchivedTransaction)
+        for tx in db.query(model).filter(
+            model.user_id == user_id,
+            model.external_id.in_(rows)
+        ).all()
+    }
+
+    statuses = {}
+    changed = []
+    shifts = []
+    spend = []
+    for external_id, data in rows.items():
+        old = existing.get(external_id)
+        if old is None:
+            statuses[external_id] = "inserted"
+            shifts.append((data["date"], data["amount"]))
+            spend.append((data["category_id"], data["date"], data["amount"], 1))
+        elif any(getattr(old, field) != data[field] for field in IMPORT_FIELDS):
+            statuses[external_id] = "updated"
+            shifts.append((old.date, -old.amount))
+            shifts.append((data["date"], data["amount"]))
+            spend.append((old.category_id, old.date, old.amount, -1))
+            spend.append((data["category_id"], data["date"], data["amount"], 1))
+            # Змінений архівний рядок повертаємо в гарячу таблицю, де діє унікальний індекс
+            if isinstance(old, models.ArchivedTransaction):
+                restore_archived_transaction(db, old.id, user_id)
+        else:
+            statuses[external_id] = "unchanged"
+            continue
+        changed.append({"user_id": user_id, "external_id": external_id, **data})
+
+    ids = {external_id: tx.id for external_id, tx in existing.items()}
+    if changed:
+        stmt = sqlite_insert(models.Transaction).values(changed)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Transaction.user_id, models.Transaction.external_id],
+            set_={field: stmt.excluded[field] for field in IMPORT_FIELDS}
+        ).returning(models.Transaction.id, models.Transaction.external_id)
+        ids.update({external_id: tx_id for tx_id, external_id in db.execute(stmt).all()})
+
+        shift_balance_checkpoints_bulk(db, user_id, shifts)
+        track_category_spend(db, user_id, spend)
+        db.execute(insert(models.ChangeLog), [
+            {"user_id": user_id, "entity": "transaction", "entity_id": ids[external_id],
+             "op": "insert" if status == "inserted" else "update", "created_at": datetime.utcnow()}
+            for external_id, status in statuses.items() if status != "unchanged"
+        ])
+    db.commit()
+
+    if changed:
+        # Пакетна зміна: простіше перезавантажити read model, ніж патчити по рядку
+        readmodel.store.evict(user_id)
+        if events.broker.has_subscribers(user_id):
+            events.broker.publish(user_id, {
+                "type": "import",
+                "inserted": sum(status == "inserted" for status in statuses.values()),
+                "updated": sum(status == "updated" for status in statuses.values()),
+                "balance": get_user_balance(db, user_id),
+            })
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    for status in statuses.values():
+        counts[status] += 1
+    return {
+        **counts,
+        "items": [
+            {"external_id": external_id, "id": ids[external_id], "status": status}
+            for external_id, status in statuses.items()
+        ],
+    }
+
+TRANSACTION_FILTERS = ("start_date", "end_date", "category_id", "min_amount", "max_amount")
+
+# Параметри запиту списку; набір ключів — "форма" запиту для _transactions_stmt
+def _transaction_params(user_id: int, filters: TransactionFilter) -> dict:
+    params = {"user_id": user_id}
+    for name in TRANSACTION_FILTERS:
+        value = getattr(filters, name)
+        if value is not None:
+            params[name] = value
+    if filters.title:
+        params["title"] = f"%{filters.title}%"
+    return params
+
+# Транзакції користувача (date desc): один statement на форму запиту,
+# значення фільтрів, skip і limit — bound-параметри
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _transactions_stmt(
+    model,
+    shape: frozenset,
+    fields: Optional[tuple[str, ...]] = None,
+    offset: bool = False,
+    limit: bool = False
+):
+    stmt = select(model).where(model.user_id == bindparam("user_id"))
 
     # Фільтр за датою
-    if filters.start_date:
-        query = query.filter(models.Transaction.date >= filters.start_date)
-    if filters.end_date:
-        query = query.filter(models.Transaction.date <= filters.end_date)
+    if "start_date" in shape:
+        stmt = stmt.where(model.date >= bindparam("start_date"))
+    if "end_date" in shape:
+        stmt = stmt.where(model.date <= bindparam("end_date"))
 
     # Фільтр за категорією
-    if filters.category_id is not None:
-        query = query.filter(models.Transaction.category_id == filters.category_id)
+    if "category_id" in shape:
+        stmt = stmt.where(model.category_id == bindparam("category_id"))
 
     # Фільтр за сумою
-    if filters.min_amount is not None:
-        query = query.filter(models.Transaction.amount >= filters.min_amount)
-    if filters.max_amount is not None:
-        query = query.filter(models.Transaction.amount <= filters.max_amount)
+    if "min_amount" in shape:
+        stmt = stmt.where(model.amount >= bindparam("min_amount"))
+    if "max_amount" in shape:
+        stmt = stmt.where(model.amount <= bindparam("max_amount"))
 
     # Пошук за назвою
-    if filters.title:
-        query = query.filter(models.Transaction.title.ilike(f"%{filters.title}%"))
+    if "title" in shape:
+        stmt = stmt.where(model.title.ilike(bindparam("title")))
+
+    if fields is not None:
+        # date потрібна для злиття з архівом
+        stmt = stmt.options(load_only(*_columns(model, fields, "date")))
+
+    stmt = stmt.order_by(model.date.desc())
+    if offset:
+        stmt = stmt.offset(bindparam("skip"))
+    if limit:
+        stmt = stmt.limit(bindparam("limit"))
+    return stmt
 
-    return query.order_by(models.Transaction.date.desc()).offset(skip).limit(limit).all()
+# ПОКАЗАТИ УСІ ТРАНЗАКЦІЇ ПОТОЧНОГО КОРИСТУВАЧА
+def get_user_transactions(
+    db: Session,
+    user_id: int,
+    filters: TransactionFilter,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[list[str]] = None
+) -> list[models.Transaction]:
+    rows = _query_read_model(db, user_id, filters, skip, limit)
+    if rows is not None:
+        return rows
+
+    params = _transaction_params(user_id, filters)
+    shape = frozenset(params)
+    columns = tuple(fields) if fields is not None else None
+    if not _archive_reached(get_archive_state(db, user_id), filters.start_date):
+        stmt = _transactions_stmt(models.Transaction, shape, columns, offset=True, limit=True)
+        return db.execute(stmt, {**params, "skip": skip, "limit": limit}).scalars().all()
+
+    # Діапазон сягає архіву: беремо по skip+limit з кожної таблиці і зливаємо
+    params["limit"] = skip + limit
+    txs = db.execute(_transactions_stmt(models.Transaction, shape, columns, limit=True), params).scalars().all()
+    archived = db.execute(_transactions_stmt(models.ArchivedTransaction, shape, columns, limit=True), params).scalars().all()
+    return _merge_by_date(txs, archived)[skip:skip + limit]
 
 # ПОКАЗАТИ ТРАНЗАКЦІЇ ПОТОЧНОГО КОРИСТУВАЧА ЗА КАТЕГОРІЄЮ
 def get_transactions_by_category(db: Session, category_id: int):
@@ -331,18 +833,383 @@ def get_transaction(db: Session, transaction_id: int, user_id: int) -> Optional[
     return db.query(models.Transaction).filter(models.Transaction.id == transaction_id, models.Transaction.user_id == user_id).first()
 
 # ПОКАЗАТИ БАЛАНС ПОТОЧНОГО КОРИСТУВАЧА
+USER_BALANCE = select(func.coalesce(func.sum(models.Transaction.amount), 0.0)).where(
+    models.Transaction.user_id == bindparam("user_id")
+)
+
 def get_user_balance(db: Session, user_id: int) -> float:
-    total = db.query(func.coalesce(func.sum(models.Transaction.amount), 0.0)).filter(models.Transaction.user_id == user_id).scalar()
-    return float(total)
+    total = db.execute(USER_BALANCE, {"user_id": user_id}).scalar()
+    # Архів не сумуємо: його підсумок зберігається в ArchiveState
+    state = get_archive_state(db, user_id)
+    return float(total) + (state.total if state else 0.0)
+
+# Сума транзакцій у [start, end) (або [start, end], якщо inclusive), з архівом за потреби
+def _sum_transactions(db: Session, user_id: int, start: Optional[datetime], end: datetime, inclusive: bool = False) -> float:
+    total = 0.0
+    models_to_sum = [models.Transaction]
+    if _archive_reached(get_archive_state(db, user_id), start):
+        models_to_sum.append(models.ArchivedTransaction)
+    for model in models_to_sum:
+        query = db.query(func.coalesce(func.sum(model.amount), 0.0)).filter(
+            model.user_id == user_id,
+            model.date <= end if inclusive else model.date < end
+        )
+        if start is not None:
+            query = query.filter(model.date >= start)
+        total += float(query.scalar())
+    return total
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+def _next_month(dt: datetime) -> datetime:
+    return datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+
+def _last_checkpoint(db: Session, user_id: int, until: datetime) -> Optional[models.BalanceCheckpoint]:
+    return db.query(models.BalanceCheckpoint).filter(
+        models.BalanceCheckpoint.user_id == user_id,
+        models.BalanceCheckpoint.period_end <= until
+    ).order_by(models.BalanceCheckpoint.period_end.desc()).first()
+
+# Створити відсутні щомісячні контрольні точки до until (початок місяця) включно
+def _materialize_checkpoints(db: Session, user_id: int, until: datetime) -> float:
+    last = _last_checkpoint(db, user_id, until)
+    if last is not None and last.period_end == until:
+        return last.balance
+
+    # Сумування й вставка — в одній транзакції запису (BEGIN IMMEDIATE): інакше зміна
+    # "заднім числом", закомічена між ними, зсуне лише вже існуючі точки, а нові її пропустять
+    db.commit()
+    db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+    try:
+        last = _last_checkpoint(db, user_id, until)
+        if last is not None and last.period_end == until:
+            balance = last.balance
+            db.commit()
+            return balance
+
+        start = last.period_end if last else None
+        balance = last.balance if last else 0.0
+
+        # Суми по місяцях між останньою точкою та until — одним згрупованим запитом на таблицю
+        monthly = defaultdict(float)
+        models_to_sum = [models.Transaction]
+        if _archive_reached(get_archive_state(db, user_id), start):
+            models_to_sum.append(models.ArchivedTransaction)
+        for model in models_to_sum:
+            month = func.strftime("%Y-%m", model.date)
+            query = db.query(month, func.sum(model.amount)).filter(
+                model.user_id == user_id,
+                model.date < until
+            )
+            if start is not None:
+                query = query.filter(model.date >= start)
+            for key, total in query.group_by(month).all():
+                monthly[key] += total
+
+        if start is None:
+            if not monthly:
+                db.commit()
+                return 0.0
+            first = min(monthly)
+            start = datetime(int(first[:4]), int(first[5:7]), 1)
+
+        rows = []
+        period = start
+        while period < until:
+            balance += monthly.get(period.strftime("%Y-%m"), 0.0)
+            period = _next_month(period)
+            rows.append({"user_id": user_id, "period_end": period, "balance": balance})
+        db.execute(insert(models.BalanceCheckpoint), rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return balance
+
+# БАЛАНС НА ДАТУ: найближча контрольна точка + сума транзакцій від неї до as_of.
+# Точки створюються не далі початку поточного місяця: майбутні періоди не зберігаємо,
+# інакше кожна зміна транзакції оновлювала б їх усі.
+def get_user_balance_as_of(db: Session, user_id: int, as_of: datetime) -> float:
+    as_of = _naive(as_of)
+    checkpoint = min(_month_start(as_of), _month_start(_naive(datetime.now(timezone.utc))))
+    balance = _materialize_checkpoints(db, user_id, checkpoint)
+    return balance + _sum_transactions(db, user_id, checkpoint, as_of, inclusive=True)
+
+# Транзакція з датою date змінила баланс на delta — коригуємо всі пізніші точки.
+# Викликати до db.commit(), у тій самій транзакції, що й зміна.
+def shift_balance_checkpoints(db: Session, user_id: int, date: Optional[datetime], delta: float) -> None:
+    if date is None or not delta:
+        return
+    db.query(models.BalanceCheckpoint).filter(
+        models.BalanceCheckpoint.user_id == user_id,
+        models.BalanceCheckpoint.period_end > _naive(date)
+    ).update({models.BalanceCheckpoint.balance: models.BalanceCheckpoint.balance + delta}, synchronize_session=False)
+
+# Те саме для багатьох змін: точки — початки місяців, тож "period_end > date"
+# рівносильне "period_end > початок місяця date" — один UPDATE на місяць
+def shift_balance_checkpoints_bulk(db: Session, user_id: int, changes: list[tuple[Optional[datetime], float]]) -> None:
+    by_month = defaultdict(float)
+    for date, delta in changes:
+        if date is not None:
+            by_month[_month_start(_naive(date))] += delta
+    for month, delta in by_month.items():
+        shift_balance_checkpoints(db, user_id, month, delta)
 
 # Update get_category_transactions to support pagination
 def get_category_transactions(db: Session, category_id: int, user_id: int, skip: int = 0, limit: int = 100) -> list[models.Transaction]:
     cat = db.query(models.Category).filter(models.Category.id == category_id, models.Category.user_id == user_id).first()
     if not cat:
         return []
-    return db.query(models.Transaction).filter(models.Transaction.category_id == category_id).order_by(models.Transaction.date.desc()).offset(skip).limit(limit).all()
+    query = db.query(models.Transaction).filter(models.Transaction.category_id == category_id).order_by(models.Transaction.date.desc())
+    if not _archive_reached(get_archive_state(db, user_id)):
+        return query.offset(skip).limit(limit).all()
+    archived = db.query(models.ArchivedTransaction).filter(
+        models.ArchivedTransaction.category_id == category_id
+    ).order_by(models.ArchivedTransaction.date.desc()).limit(skip + limit).all()
+    return _merge_by_date(query.limit(skip + limit).all(), archived)[skip:skip + limit]
+
+# ЗВІТ РІК ДО РОКУ: доходи/витрати по місяцях (і, за бажанням, по категоріях).
+# Виконується у фоновому процесі (app/jobs.py), тому повертає лише JSON-сумісні дані.
+def build_report(db: Session, user_id: int, spec: schemas.ReportSpec) -> dict:
+    start = datetime(spec.start_year, 1, 1)
+    end = datetime(spec.end_year + 1, 1, 1)
+
+    totals = defaultdict(lambda: {"income": 0.0, "expense": 0.0})
+    models_to_sum = [models.Transaction]
+    if _archive_reached(get_archive_state(db, user_id), start):
+        models_to_sum.append(models.ArchivedTransaction)
+    for model in models_to_sum:
+        year = func.strftime("%Y", model.date)
+        month = func.strftime("%m", model.date)
+        group = [year, month, model.category_id] if spec.by_category else [year, month]
+        query = db.query(
+            *group,
+            func.coalesce(func.sum(case((model.amount > 0, model.amount), else_=0.0)), 0.0),
+            func.coalesce(func.sum(case((model.amount < 0, model.amount), else_=0.0)), 0.0),
+        ).filter(model.user_id == user_id, model.date >= start, model.date < end)
+        if spec.category_id is not None:
+            query = query.filter(model.category_id == spec.category_id)
+        for row in query.group_by(*group).all():
+            key = tuple(row[:len(group)])
+            totals[key]["income"] += row[-2]
+            totals[key]["expense"] += row[-1]
+
+    years = {}
+    for y in range(spec.start_year, spec.end_year + 1):
+        years[str(y)] = {"income": 0.0, "expense": 0.0, "months": {f"{m:02d}": {"income": 0.0, "expense": 0.0} for m in range(1, 13)}}
+        if spec.by_category:
+            years[str(y)]["categories"] = {}
+    for key, value in totals.items():
+        year = years[key[0]]
+        year["income"] += value["income"]
+        year["expense"] += value["expense"]
+        month = year["months"][key[1]]
+        month["income"] += value["income"]
+        month["expense"] += value["expense"]
+        if spec.by_category:
+            cat = year["categories"].setdefault(str(key[2]), {"income": 0.0, "expense": 0.0})
+            cat["income"] += value["income"]
+            cat["expense"] += value["expense"]
+
+    # Зміна нетто-результату відносно попереднього року, %
+    change = {}
+    for y in range(spec.start_year + 1, spec.end_year + 1):
+        prev = years[str(y - 1)]["income"] + years[str(y - 1)]["expense"]
+        curr = years[str(y)]["income"] + years[str(y)]["expense"]
+        change[str(y)] = round((curr - prev) / abs(prev) * 100, 2) if prev else None
+
+    return {"years": years, "net_change_pct": change}
+
+# Archive (гарячі / холодні транзакції)
+
+ARCHIVE_COLUMNS = ("id", "user_id", "category_id", "title", "amount", "date", "notes", "external_id", "created_at")
+
+def _naive(dt: datetime) -> datetime:
+    # SQLite зберігає DateTime без часової зони
+    return dt.replace(tzinfo=None) if dt.tzinfo else dt
+
+def _merge_by_date(*lists) -> list:
+    return list(heapq.merge(*lists, key=lambda tx: tx.date or datetime.min, reverse=True))
+
+def get_archive_state(db: Session, user_id: int) -> Optional[models.ArchiveState]:
+    return db.get(models.ArchiveState, user_id)
+
+# Чи треба читати архів: лише якщо в ньому щось є і діапазон починається до межі
+def _archive_reached(state: Optional[models.ArchiveState], start_date: Optional[datetime] = None) -> bool:
+    if state is None or not state.count:
+        return False
+    return start_date is None or _naive(start_date) < state.cutoff
+
+# ПЕРЕНЕСТИ В АРХІВ УСІ ТРАНЗАКЦІЇ, СТАРІШІ ЗА cutoff (пакетами, коміт на кожен пакет)
+def archive_transactions(db: Session, cutoff: datetime, batch_size: int = 1000) -> int:
+    cutoff = _naive(cutoff)
+    # Найновіший рядок не чіпаємо: у старих базах без AUTOINCREMENT SQLite
+    # видав би його id повторно
+    newest_id = db.query(func.max(models.Transaction.id)).scalar()
+    columns = [getattr(models.Transaction, name) for name in ARCHIVE_COLUMNS]
+    moved = 0
+    while True:
+        rows = db.query(models.Transaction.id, models.Transaction.user_id, models.Transaction.amount).filter(
+            models.Transaction.date < cutoff,
+            models.Transaction.id != newest_id
+        ).order_by(models.Transaction.id).limit(batch_size).all()
+        if not rows:
+            break
+        ids = [row.id for row in rows]
+        db.execute(insert(models.ArchivedTransaction).from_select(
+            list(ARCHIVE_COLUMNS), select(*columns).where(models.Transaction.id.in_(ids))
+        ))
+        db.execute(delete(models.Transaction).where(models.Transaction.id.in_(ids)))
+
+        totals = defaultdict(lambda: [0.0, 0])
+        for row in rows:
+            totals[row.user_id][0] += row.amount
+            totals[row.user_id][1] += 1
+        for uid, (total, count) in totals.items():
+            state = get_archive_state(db, uid)
+            if state is None:
+                state = models.ArchiveState(user_id=uid, cutoff=cutoff, total=0.0, count=0)
+                db.add(state)
+            state.cutoff = max(state.cutoff, cutoff)
+            state.total += total
+            state.count += count
+        db.commit()
+        moved += len(rows)
+    return moved
+
+# Повернути транзакцію з архіву в гарячу таблицю (перед зміною/видаленням).
+# Без коміту — зберігається разом з основною зміною.
+def restore_archived_transaction(db: Session, transaction_id: int, user_id: int) -> Optional[models.Transaction]:
+    archived = db.query(models.ArchivedTransaction).filter(
+        models.ArchivedTransaction.id == transaction_id,
+        models.ArchivedTransaction.user_id == user_id
+    ).first()
+    if not archived:
+        return None
+    state = get_archive_state(db, user_id)
+    if state is not None:
+        state.total -= archived.amount
+        state.count -= 1
+    transaction = models.Transaction(**{name: getattr(archived, name) for name in ARCHIVE_COLUMNS})
+    db.delete(archived)
+    db.add(transaction)
+    db.flush()
+    return transaction
 
 
+# Budgets
+
+def _month_key(date: datetime) -> str:
+    return _naive(date).strftime("%Y-%m")
+
+# Оновити лічильники витрат (category_id, місяць) одним upsert'ом.
+# changes: (category_id, date, amount, sign): sign=1 — транзакцію додано, -1 — прибрано.
+# Витратами вважаються лише від'ємні суми. Викликати до db.commit().
+def track_category_spend(db: Session, user_id: int, changes: list[tuple[Optional[int], Optional[datetime], float, int]]) -> None:
+    deltas = defaultdict(float)
+    for category_id, date, amount, sign in changes:
+        if category_id is None or date is None or amount >= 0:
+            continue
+        deltas[(category_id, _month_key(date))] += sign * -amount
+    rows = [
+        {"category_id": category_id, "month": month, "user_id": user_id, "spent": delta}
+        for (category_id, month), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return
+    stmt = sqlite_insert(models.CategoryMonthSpend).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.CategoryMonthSpend.category_id, models.CategoryMonthSpend.month],
+        set_={"spent": models.CategoryMonthSpend.spent + stmt.excluded.spent}
+    )
+    db.execute(stmt)
+
+# Перерахувати лічильники категорії з транзакцій (при створенні бюджету):
+# до цього вони могли бути неповними для даних, записаних раніше
+def _backfill_category_spend(db: Session, user_id: int, category_id: int) -> None:
+    db.query(models.CategoryMonthSpend).filter(
+        models.CategoryMonthSpend.category_id == category_id
+    ).delete(synchronize_session=False)
+    totals = defaultdict(float)
+    for model in (models.Transaction, models.ArchivedTransaction):
+        month = func.strftime("%Y-%m", model.date)
+        for key, spent in db.query(month, -func.sum(model.amount)).filter(
+            model.user_id == user_id,
+            model.category_id == category_id,
+            model.amount < 0
+        ).group_by(month).all():
+            totals[key] += spent
+    if totals:
+        db.execute(insert(models.CategoryMonthSpend), [
+            {"category_id": category_id, "month": month, "user_id": user_id, "spent": spent}
+            for month, spent in totals.items()
+        ])
+
+def create_budget(db: Session, user_id: int, budget_in: schemas.BudgetCreate) -> models.Budget:
+    if not user_owns_category(db, user_id, budget_in.category_id):
+        raise HTTPException(status_code=400, detail="Invalid category")
+    exists = db.query(models.Budget).filter(models.Budget.category_id == budget_in.category_id).first()
+    if exists:
+        raise HTTPException(status_code=400, detail="Budget for this category already exists")
+
+    budget = models.Budget(user_id=user_id, category_id=budget_in.category_id, monthly_limit=budget_in.monthly_limit)
+    db.add(budget)
+    _backfill_category_spend(db, user_id, budget_in.category_id)
+    db.commit()
+    db.refresh(budget)
+    return budget
+
+def get_budget(db: Session, budget_id: int, user_id: int) -> Optional[models.Budget]:
+    return db.query(models.Budget).filter(models.Budget.id == budget_id, models.Budget.user_id == user_id).first()
+
+def update_budget(db: Session, budget_id: int, user_id: int, budget_in: schemas.BudgetUpdate) -> Optional[models.Budget]:
+    budget = get_budget(db, budget_id, user_id)
+    if not budget:
+        return None
+    budget.monthly_limit = budget_in.monthly_limit
+    db.commit()
+    db.refresh(budget)
+    return budget
+
+def delete_budget(db: Session, budget_id: int, user_id: int) -> bool:
+    budget = get_budget(db, budget_id, user_id)
+    if not budget:
+        return False
+    db.delete(budget)
+    db.commit()
+    return True
+
+# СТАН УСІХ БЮДЖЕТІВ ЗА МІСЯЦЬ — один запит по індексах, без сумування транзакцій
+def get_budget_statuses(db: Session, user_id: int, month: str) -> list[dict]:
+    rows = db.query(
+        models.Budget,
+        models.Category.name,
+        func.coalesce(models.CategoryMonthSpend.spent, 0.0)
+    ).join(
+        models.Category, models.Category.id == models.Budget.category_id
+    ).outerjoin(
+        models.CategoryMonthSpend,
+        and_(
+            models.CategoryMonthSpend.category_id == models.Budget.category_id,
+            models.CategoryMonthSpend.month == month
+        )
+    ).filter(models.Budget.user_id == user_id).order_by(models.Category.name).all()
+
+    return [
+        {
+            "budget_id": budget.id,
+            "category_id": budget.category_id,
+            "category_name": name,
+            "month": month,
+            "monthly_limit": budget.monthly_limit,
+            "spent": spent,
+            "remaining": budget.monthly_limit - spent,
+            "percent_used": round(spent / budget.monthly_limit * 100, 2),
+        }
+        for budget, name, spent in rows
+    ]
+
 
 # MKR-1
 # Libraries
@@ -362,50 +1229,161 @@ def create_library(db: Session, user_id: int, lib_in: schemas.LibraryCreate) ->
 
     db_lib = models.Library(**lib_in.model_dump(), user_id=user_id)
     db.add(db_lib)
+    db.flush()
+    log_change(db, user_id, "library", db_lib.id, "insert")
     db.commit()
+    cache.library_stats.invalidate(user_id)
     db.refresh(db_lib)
     return db_lib
 
+LIBRARY_SORT_COLUMNS = {
+    "name": models.Library.library_name,
+    "books": models.Library.books_amount,
+    "visitors": models.Library.visitors_per_year,
+    "created": models.Library.created_at
+}
+
+# engine -> чи є libraries_fts (на SQLite без FTS5 trigram її не створено); перевіряємо раз
+_libraries_fts_available: dict = {}
+
+def _has_libraries_fts(db: Session) -> bool:
+    bind = db.get_bind()
+    available = _libraries_fts_available.get(bind)
+    if available is None:
+        conn = db.connection()
+        available = models.fts_trigram_supported(conn) and conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'libraries_fts'"
+        ).first() is not None
+        _libraries_fts_available[bind] = available
+    return available
+
+# Пошук за назвою: FTS5 trigram-індекс (підрядок, без урахування регістру, як ilike).
+# Trigram не знаходить рядки коротші за 3 символи — для них лишаємо ilike.
+def _library_name_filter(db: Session, search: str):
+    if db.bind.dialect.name == "sqlite" and len(search) >= 3 and _has_libraries_fts(db):
+        phrase = '"' + search.replace('"', '""') + '"'
+        matched = select(models.libraries_fts.c.rowid).where(
+            literal_column("libraries_fts").op("MATCH")(phrase)
+        )
+        return models.Library.id.in_(matched)
+    return models.Library.library_name.ilike(f"%{search}%")
+
+def _filter_libraries(db: Session, query, filters: schemas.LibraryFilter, with_city: bool = True):
+    if filters.search:
+        query = query.filter(_library_name_filter(db, filters.search))
+    if with_city and filters.city:
+        query = query.filter(models.Library.city == filters.city)
+    if filters.min_books is not None:
+        query = query.filter(models.Library.books_amount >= filters.min_books)
+    return query
+
+def _sort_libraries(query, filters: schemas.LibraryFilter):
+    col = LIBRARY_SORT_COLUMNS.get(filters.sort_by) if filters.sort_by else None
+    if col is not None:
+        order = col.desc() if filters.sort_order == "desc" else col.asc()
+        query = query.order_by(order)
+    return query
+
 def get_user_libraries(
     db: Session,
     user_id: int,
     filters: Optional[schemas.LibraryFilter] = None,
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    fields: Optional[list[str]] = None
 ) -> list[models.Library]:
     query = db.query(models.Library).filter(models.Library.user_id == user_id)
+    if fields is not None:
+        query = query.options(load_only(*_columns(models.Library, fields)))
 
     if filters:
-        if filters.search:
-            query = query.filter(models.Library.library_name.ilike(f"%{filters.search}%"))
-        if filters.city:
-            query = query.filter(models.Library.city == filters.city)
-        if filters.min_books is not None:
-            query = query.filter(models.Library.books_amount >= filters.min_books)
-
-        # Sorting
-        if filters.sort_by:
-            col = {
-                "name": models.Library.library_name,
-                "books": models.Library.books_amount,
-                "visitors": models.Library.visitors_per_year,
-                "created": models.Library.created_at
-            }.get(filters.sort_by)
-            if col:
-                order = col.desc() if filters.sort_order == "desc" else col.asc()
-                query = query.order_by(order)
+        query = _sort_libraries(_filter_libraries(db, query, filters), filters)
 
     return query.offset(skip).limit(limit).all()
 
-def get_library_stats(db: Session, user_id: int):
-    total_libs = db.query(models.Library).filter(models.Library.user_id == user_id).count()
-    total_books = db.query(func.sum(models.Library.books_amount)).filter(models.Library.user_id == user_id).scalar() or 0
-    total_visitors = db.query(func.sum(models.Library.visitors_per_year)).filter(models.Library.user_id == user_id).scalar() or 0
-    return {
-        "total_libraries": total_libs,
-        "total_books": int(total_books),
-        "total_visitors": int(total_visitors)
-    }
+# ПОШУК БІБЛІОТЕК + КІЛЬКІСТЬ ЗА МІСТАМИ (фасети) В ОДНІЙ ВІДПОВІДІ
+def search_libraries(
+    db: Session,
+    user_id: int,
+    filters: schemas.LibraryFilter,
+    skip: int = 0,
+    limit: int = 100
+) -> dict:
+    items = get_user_libraries(db, user_id, filters, skip, limit)
+
+    # Фасети рахуємо без фільтра city, щоб UI міг показати інші міста;
+    # total для поточного фільтра виводимо з них же — без окремого count()
+    facet_rows = _filter_libraries(
+        db,
+        db.query(models.Library.city, func.count(models.Library.id)).filter(models.Library.user_id == user_id),
+        filters,
+        with_city=False
+    ).group_by(models.Library.city).order_by(func.count(models.Library.id).desc(), models.Library.city).all()
+
+    facets = [{"city": city, "count": count} for city, count in facet_rows]
+    if filters.city:
+        total = next((f["count"] for f in facets if f["city"] == filters.city), 0)
+    else:
+        total = sum(f["count"] for f in facets)
+    return {"items": items, "total": total, "city_facets": facets}
+
+LIBRARY_STATS_GROUP_BY = {"city"}
+LIBRARY_STATS_MAX_TOP = 50
+
+def get_library_stats(db: Session, user_id: int, group_by: Optional[str] = None, top: int = 5) -> schemas.LibraryStats:
+    if group_by is not None and group_by not in LIBRARY_STATS_GROUP_BY:
+        raise HTTPException(status_code=400, detail="Unsupported group_by")
+    top = max(0, min(top, LIBRARY_STATS_MAX_TOP))
+
+    # Запис валідний при збігу версії бібліотек у журналі змін — так видно зміни з інших воркерів
+    version = get_data_version(db, user_id, "library")
+    cached = cache.library_stats.get(user_id, (group_by, top))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    # Усі агрегати — одним запитом (з групуванням за містом, якщо треба)
+    columns = [
+        func.count(models.Library.id).label("total_libraries"),
+        func.coalesce(func.sum(models.Library.books_amount), 0).label("total_books"),
+        func.coalesce(func.sum(models.Library.visitors_per_year), 0).label("total_visitors"),
+    ]
+    query = db.query(*columns).filter(models.Library.user_id == user_id)
+    if group_by == "city":
+        query = db.query(models.Library.city, *columns).filter(
+            models.Library.user_id == user_id
+        ).group_by(models.Library.city).order_by(models.Library.city)
+    rows = query.all()
+
+    total_libs = sum(row.total_libraries for row in rows)
+    total_books = sum(int(row.total_books) for row in rows)
+    total_visitors = sum(int(row.total_visitors) for row in rows)
+    stats = schemas.LibraryStats(
+        total_libraries=total_libs,
+        total_books=total_books,
+        total_visitors=total_visitors,
+        avg_books=total_books / total_libs if total_libs else 0.0,
+        avg_visitors=total_visitors / total_libs if total_libs else 0.0,
+    )
+    if group_by == "city":
+        stats.by_city = [
+            schemas.LibraryCityStats(
+                city=row.city,
+                total_libraries=row.total_libraries,
+                total_books=int(row.total_books),
+                total_visitors=int(row.total_visitors),
+                avg_books=int(row.total_books) / row.total_libraries,
+                avg_visitors=int(row.total_visitors) / row.total_libraries,
+            )
+            for row in rows
+        ]
+    if top and total_libs:
+        top_libs = db.query(models.Library).filter(
+            models.Library.user_id == user_id
+        ).order_by(models.Library.visitors_per_year.desc()).limit(top).all()
+        stats.top_libraries = [schemas.LibraryRead.model_validate(lib) for lib in top_libs]
+
+    cache.library_stats.set(user_id, (version, stats), (group_by, top))
+    return stats
 
 def get_library(db: Session, library_id: int, user_id: int) -> Optional[models.Library]:
     return db.query(models.Library).filter(models.Library.id == library_id, models.Library.user_id == user_id).first()
@@ -438,7 +1416,9 @@ def update_library(db: Session, library_id: int, user_id: int, lib_in: schemas.L
     for key, value in data.items():
         setattr(library, key, value)
 
+    log_change(db, user_id, "library", library_id, "update")
     db.commit()
+    cache.library_stats.invalidate(user_id)
     db.refresh(library)
     return library
 
@@ -447,5 +1427,7 @@ def delete_library(db: Session, library_id: int, user_id: int) -> bool:
     if not library:
         return False
     db.delete(library)
+    log_change(db, user_id, "library", library_id, "delete")
     db.commit()
+    cache.library_stats.invalidate(user_id)
     return True
\ No newline at end of file
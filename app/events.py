@@ -0,0 +1,70 @@
+import asyncio
+import json
+from threading import Lock
+from typing import Any
+
+# In-process pub/sub для push-оновлень (SSE /profile/stream).
+# crud публікує з потоків threadpool'а, тому події передаються в event loop
+# підписника через call_soon_threadsafe.
+
+QUEUE_SIZE = 100  # подій на одного підписника
+HEARTBEAT_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int = QUEUE_SIZE):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    # Виконується в event loop підписника
+    def _put(self, event: dict) -> None:
+        if self.queue.full():
+            # Повільний клієнт: скидаємо накопичене і просимо перечитати стан.
+            # Поточна подія все одно несе актуальний баланс.
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "overflow"})
+        self.queue.put_nowait(event)
+
+
+class EventBroker:
+    def __init__(self):
+        self._subscribers: dict[int, set[Subscription]] = {}
+        self._lock = Lock()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        sub = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, user_id: int, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._subscribers
+
+    def publish(self, user_id: int, event: dict) -> None:
+        with self._lock:
+            subs = list(self._subscribers.get(user_id, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._put, event)
+            except RuntimeError:
+                # event loop вже закритий
+                self.unsubscribe(user_id, sub)
+
+
+def format_sse(event: dict[str, Any]) -> str:
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+broker = EventBroker()
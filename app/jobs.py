@@ -0,0 +1,173 @@
+import json
+import multiprocessing
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Optional
+from . import crud, database, schemas
+
+# Фонові звіти: виконуються в пулі процесів, щоб не займати потоки запитів.
+# Стан задач і результати — у спільному для всіх API-воркерів SQLite-файлі
+# (як app/responsecache.py), тож опитувати можна будь-який воркер; локальним
+# лишається тільки виконання. Готовий результат перевикористовується за
+# (user_id, spec, версія даних користувача) — версія береться з журналу змін,
+# тож будь-який запис робить його неактуальним.
+
+PATH = "./report_jobs.db"
+REPORT_WORKERS = 2
+MAX_JOBS = 1000
+# pending довше за це — воркер, що рахував, найімовірніше перезапустився
+PENDING_TIMEOUT = timedelta(minutes=10)
+BUSY_TIMEOUT_SECONDS = 5
+
+
+def _run_report(user_id: int, spec: dict) -> dict:
+    db = database.SessionLocal()
+    try:
+        return crud.build_report(db, user_id, schemas.ReportSpec(**spec))
+    finally:
+        db.close()
+
+
+class Job:
+    __slots__ = ("id", "user_id", "spec", "status", "result", "error", "created_at", "cached")
+
+    def __init__(self, row: sqlite3.Row):
+        self.id = row["id"]
+        self.user_id = row["user_id"]
+        self.spec = schemas.ReportSpec.model_validate_json(row["spec"])
+        self.status = row["status"]
+        self.result: Optional[dict] = json.loads(row["result"]) if row["result"] is not None else None
+        self.error: Optional[str] = row["error"]
+        self.created_at = datetime.fromisoformat(row["created_at"])
+        self.cached = bool(row["cached"])
+        if self.status == "pending" and datetime.utcnow() - self.created_at > PENDING_TIMEOUT:
+            self.status, self.error = "failed", "Report timed out"
+
+
+class JobRunner:
+    def __init__(self, path: str = PATH, max_workers: int = REPORT_WORKERS):
+        self.path = path
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS report_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " user_id INTEGER NOT NULL,"
+                " spec TEXT NOT NULL,"
+                " data_version INTEGER NOT NULL,"
+                " status TEXT NOT NULL,"  # pending | done | failed
+                " result TEXT,"
+                " error TEXT,"
+                " cached INTEGER NOT NULL DEFAULT 0,"
+                " created_at TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_report_jobs_key ON report_jobs (user_id, spec, data_version)"
+            )
+            self._local.conn = conn
+        return conn
+
+    # spawn: воркери не успадковують потоки й з'єднання API-процесу (fork з потоками небезпечний)
+    def _get_executor(self, broken: Optional[ProcessPoolExecutor] = None) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            # Пул зламаний назавжди, якщо процес-воркер аварійно завершився (OOM, kill) — замінюємо
+            if broken is not None and self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _start(self, user_id: int, spec: schemas.ReportSpec) -> Future:
+        executor = self._get_executor()
+        try:
+            return executor.submit(_run_report, user_id, spec.model_dump())
+        except BrokenProcessPool:
+            return self._get_executor(broken=executor).submit(_run_report, user_id, spec.model_dump())
+
+    def submit(self, user_id: int, spec: schemas.ReportSpec, data_version: int) -> Job:
+        conn = self._connect()
+        spec_json = spec.model_dump_json()
+        now = datetime.utcnow()
+        # BEGIN IMMEDIATE: перевірка й вставка атомарні між воркерами
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT * FROM report_jobs WHERE user_id = ? AND spec = ? AND data_version = ? "
+                "AND status IN ('pending', 'done') ORDER BY status = 'done' DESC, created_at DESC",
+                (user_id, spec_json, data_version),
+            ).fetchall()
+            done = next((row for row in rows if row["status"] == "done"), None)
+            # Такий самий звіт уже рахується (у будь-якому воркері) — віддаємо ту саму задачу
+            pending = next(
+                (row for row in rows if row["status"] == "pending" and Job(row).status == "pending"), None
+            )
+            if done is None and pending is not None:
+                conn.execute("COMMIT")
+                return Job(pending)
+            job_id = uuid.uuid4().hex
+            status, result, cached = ("done", done["result"], 1) if done is not None else ("pending", None, 0)
+            conn.execute(
+                "INSERT INTO report_jobs (id, user_id, spec, data_version, status, result, cached, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, spec_json, data_version, status, result, cached, now.isoformat()),
+            )
+            conn.execute(
+                "DELETE FROM report_jobs WHERE id IN ("
+                " SELECT id FROM report_jobs ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (MAX_JOBS,),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if status == "pending":
+            try:
+                future = self._start(user_id, spec)
+            except Exception as e:
+                self._finish(job_id, error=str(e))
+            else:
+                future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return self.get(job_id, user_id)
+
+    def get(self, job_id: str, user_id: int) -> Optional[Job]:
+        row = self._connect().execute(
+            "SELECT * FROM report_jobs WHERE id = ? AND user_id = ?", (job_id, user_id)
+        ).fetchone()
+        return Job(row) if row is not None else None
+
+    def _on_done(self, job_id: str, future: Future) -> None:
+        error = future.exception()
+        if error is not None:
+            self._finish(job_id, error=str(error) or error.__class__.__name__)
+        else:
+            self._finish(job_id, result=future.result())
+
+    def _finish(self, job_id: str, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+        if error is not None:
+            self._connect().execute(
+                "UPDATE report_jobs SET status = 'failed', error = ? WHERE id = ?", (error, job_id)
+            )
+        else:
+            self._connect().execute(
+                "UPDATE report_jobs SET status = 'done', result = ? WHERE id = ?", (json.dumps(result), job_id)
+            )
+
+
+runner = JobRunner()
@@ -1,13 +1,26 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Optional
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from . import models, database, schemas, crud, security
+from starlette.background import BackgroundTask
+from . import models, database, schemas, crud, security, events, ratelimit, jobs, compression, responsecache
 from .database import get_db
 
-app = FastAPI(title="Finance Tracker API")
+# При старті дочищаємо акаунти, видалення яких перервав перезапуск (у фоні, щоб не тримати старт)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=crud.purge_deleted_users_background, daemon=True).start()
+    yield
+
+app = FastAPI(title="Finance Tracker API", lifespan=lifespan)
 
 # Allow your Vue dev server origin (adjust when deploying)
 app.add_middleware(
@@ -18,9 +31,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli для великих відповідей (brotli — якщо встановлено пакет brotli)
+COMPRESSION_MIN_SIZE = 1024  # байт
+app.add_middleware(compression.CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
 # Create tables
 models.Base.metadata.create_all(bind=database.engine)
 
+# Per-user rate limiting + обмеження одночасних запитів для класів ендпоінтів.
+# Змінюється на льоту: app.state.rate_limits = ratelimit.RateLimits({...})
+app.state.rate_limits = ratelimit.RateLimits({
+    "read": ratelimit.Limit(rate=20, burst=40, max_concurrency=32),     # дешеві читання
+    "heavy": ratelimit.Limit(rate=1, burst=5, max_concurrency=4),       # дерева, звіти, синхронізація
+    "write": ratelimit.Limit(rate=10, burst=30, max_concurrency=16),
+    # SSE: з'єднання тримає місце весь час, тож обмежуємо і кількість на користувача.
+    # З'єднання з БД стрім не тримає (лише на початкове читання балансу), тож
+    # max_concurrency обмежує відкриті сокети й черги брокера, а не пул БД
+    "stream": ratelimit.Limit(rate=1, burst=5, max_concurrency=256, max_per_user=3),
+})
+read_limit = [Depends(ratelimit.limit("read"))]
+heavy_limit = [Depends(ratelimit.limit("heavy"))]
+write_limit = [Depends(ratelimit.limit("write"))]
+
+
+@app.get("/metrics/limits")
+def read_limit_metrics():
+    limits = getattr(app.state, "rate_limits", None)
+    return limits.snapshot() if limits else {}
+
+@app.get("/metrics/response-cache")
+def read_response_cache_metrics():
+    return responsecache.responses.snapshot()
+
 
 # --- Auth / Users ---
 
@@ -49,12 +91,12 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
 
 
 # Get current logged-in user
-@app.get("/profile", response_model=schemas.UserRead)
+@app.get("/profile", response_model=schemas.UserRead, dependencies=read_limit)
 def read_current_user(current_user: models.User = Depends(security.get_current_user)):
     return current_user
 
 # Update current user
-@app.put("/profile", response_model=schemas.UserRead)
+@app.put("/profile", response_model=schemas.UserRead, dependencies=write_limit)
 def update_current_user(
     user_in: schemas.UserUpdate,
     db: Session = Depends(get_db),
@@ -66,12 +108,18 @@ def update_current_user(
     return updated_user
 
 # Delete current user
-@app.delete("/profile", status_code=204)
+@app.delete("/profile", status_code=204, dependencies=write_limit)
 def delete_current_user(
+    background_tasks: BackgroundTasks,
+    background: bool = False,  # True — дані видаляються після відповіді
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
-    crud.delete_user(db, current_user.id)
+    if background:
+        if crud.mark_user_deleted(db, current_user.id):
+            background_tasks.add_task(crud.purge_user_background, current_user.id)
+    else:
+        crud.delete_user(db, current_user.id)
     return None  # Змінено: без тіла відповіді
 
 # Видалено /users/ і /users/{user_id} для безпеки
@@ -93,7 +141,7 @@ def delete_current_user(
 
 
 # --- Categories ---
-@app.post("/categories/", response_model=schemas.CategoryRead)
+@app.post("/categories/", response_model=schemas.CategoryRead, dependencies=write_limit)
 def create_category(
     cat_in: schemas.CategoryCreate,
     db: Session = Depends(get_db),
@@ -101,18 +149,24 @@ def create_category(
 ):
     return crud.create_category(db, current_user.id, cat_in)
 
-@app.get("/profile/categories", response_model=list[schemas.CategoryRead])  # Змінено шлях для консистентності
-def read_user_categories(db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
-    return crud.get_user_categories(db, current_user.id)
+@app.get("/profile/categories", response_model=list[schemas.CategoryRead], dependencies=heavy_limit)  # Змінено шлях для консистентності
+def read_user_categories(
+    fields: Optional[str] = None,  # ?fields=id,name,children
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    # Готовий JSON зі спільного кешу відповідей (валідується версією даних користувача)
+    selected = crud.parse_fields(schemas.CategoryRead, fields)
+    return Response(crud.get_user_categories_json(db, current_user.id, selected), media_type="application/json")
 
-@app.get("/categories/{category_id}", response_model=schemas.CategoryRead)
+@app.get("/categories/{category_id}", response_model=schemas.CategoryRead, dependencies=read_limit)
 def read_category(category_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
     category = crud.get_category(db, category_id, current_user.id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found or not yours")
     return category
 
-@app.put("/categories/{category_id}", response_model=schemas.CategoryRead)
+@app.put("/categories/{category_id}", response_model=schemas.CategoryRead, dependencies=write_limit)
 def update_category(
     category_id: int,
     cat_in: schemas.CategoryUpdate,
@@ -124,7 +178,7 @@ def update_category(
         raise HTTPException(status_code=404, detail="Category not found")
     return updated
 
-@app.delete("/categories/{category_id}", status_code=204)
+@app.delete("/categories/{category_id}", status_code=204, dependencies=write_limit)
 def delete_category(
     category_id: int,
     db: Session = Depends(get_db),
@@ -141,43 +195,45 @@ def delete_category(
     return None
 
 # --- Transactions ---
-@app.post("/transactions/", response_model=schemas.TransactionRead)
+@app.post("/transactions/", response_model=schemas.TransactionRead, dependencies=write_limit)
 def create_transaction(tx_in: schemas.TransactionCreate, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
-    if tx_in.category_id:
-        cat = db.query(models.Category).filter(models.Category.id == tx_in.category_id).first()
-        if not cat or cat.user_id != current_user.id:
-            raise HTTPException(status_code=400, detail="Invalid category")
+    # Належність category_id перевіряє crud (через кеш категорій користувача)
     tx = crud.create_transaction(db, current_user.id, tx_in)
     return tx
 
+@app.post("/transactions/import", response_model=schemas.TransactionImportResult, dependencies=write_limit)
+def import_transactions(items: list[schemas.TransactionImport], db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    return crud.import_transactions(db, current_user.id, items)
+
 # @app.get("/transactions/{transaction_id}", response_model=schemas.TransactionRead)
 # def read_transaction(transaction_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
 #     transaction = crud.get_transaction(db, transaction_id, current_user.id)
 #     if not transaction:
 #         raise HTTPException(status_code=404, detail="Transaction not found or not yours")
 #     return transaction
-@app.get("/profile/transactions", response_model=list[schemas.TransactionRead])
+@app.get("/profile/transactions", response_model=list[schemas.TransactionRead], dependencies=read_limit)
 def read_user_transactions(
     filters: schemas.TransactionFilter = Depends(),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user),
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    fields: Optional[str] = None  # ?fields=id,title,amount,date
 ):
-    return crud.get_user_transactions(db, current_user.id, filters, skip, limit)
+    selected = crud.parse_fields(schemas.TransactionRead, fields)
+    rows = crud.get_user_transactions(db, current_user.id, filters, skip, limit, selected)
+    if selected is None:
+        return rows
+    return JSONResponse(jsonable_encoder(crud.project(rows, selected)))
 
-@app.put("/transactions/{transaction_id}", response_model=schemas.TransactionRead)
+@app.put("/transactions/{transaction_id}", response_model=schemas.TransactionRead, dependencies=write_limit)
 def update_transaction(transaction_id: int, tx_in: schemas.TransactionUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
-    if tx_in.category_id:
-        cat = db.query(models.Category).filter(models.Category.id == tx_in.category_id).first()
-        if not cat or cat.user_id != current_user.id:
-            raise HTTPException(status_code=400, detail="Invalid category")
     updated = crud.update_transaction(db, transaction_id, current_user.id, tx_in)
     if not updated:
         raise HTTPException(status_code=404, detail="Transaction not found or not yours")
     return updated
 
-@app.delete("/transactions/{transaction_id}", status_code=204)
+@app.delete("/transactions/{transaction_id}", status_code=204, dependencies=write_limit)
 def delete_transaction(transaction_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
     deleted = crud.delete_transaction(db, transaction_id, current_user.id)
     if not deleted:
@@ -195,12 +251,99 @@ def read_user_transactions(
 ):
     return crud.get_user_transactions(db, current_user.id, skip, limit, start_date, end_date)
 
-@app.get("/profile/balance", response_model=schemas.BalanceRead)
-def get_my_balance(db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
-    balance = crud.get_user_balance(db, current_user.id)
-    return {"balance": balance, "currency": "USD", "updated_at": datetime.utcnow()}
-
-@app.get("/profile/categories/{category_id}/transactions", response_model=list[schemas.TransactionRead])
+@app.get("/profile/balance", response_model=schemas.BalanceRead, dependencies=read_limit)
+def get_my_balance(as_of: Optional[datetime] = None, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    if as_of is not None:
+        balance = crud.get_user_balance_as_of(db, current_user.id, as_of)
+    else:
+        balance = crud.get_user_balance(db, current_user.id)
+    return {"balance": balance, "currency": "USD", "updated_at": datetime.utcnow(), "as_of": as_of}
+
+# Push замість опитування /profile/balance: Server-Sent Events з новим балансом
+# після кожної зміни транзакцій користувача
+@app.get("/profile/stream")
+async def stream_my_updates(request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    user_id = current_user.id
+    # Клас "stream" тримаємо до закриття з'єднання, а не лише до кінця обробника
+    limiter = ratelimit.acquire(request, "stream", user_id)
+
+    released = False
+
+    # Ідемпотентно: викликається з генератора і як background відповіді (якщо генератор не стартував)
+    def release():
+        nonlocal released
+        if released:
+            return
+        released = True
+        events.broker.unsubscribe(user_id, sub)
+        if limiter is not None:
+            limiter.release(user_id)
+
+    # Підписуємося до читання балансу, щоб не пропустити зміни між ними
+    sub = events.broker.subscribe(user_id)
+    try:
+        balance = await run_in_threadpool(crud.get_user_balance, db, user_id)
+    except Exception:
+        release()
+        raise
+    finally:
+        # Повертаємо з'єднання в пул до початку стріму: get_db закриє сесію лише після його кінця
+        await run_in_threadpool(db.close)
+
+    async def event_stream():
+        try:
+            yield events.format_sse({"type": "balance", "balance": balance})
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=events.HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield events.format_sse(event)
+        finally:
+            release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release),
+    )
+
+@app.get("/profile/sync", response_model=schemas.SyncResponse, dependencies=heavy_limit)
+def sync_changes(since: int = 0, limit: int = 1000, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    return crud.get_changes_since(db, current_user.id, since, limit)
+
+# --- Reports (фонові задачі) ---
+def _job_response(job: jobs.Job) -> schemas.ReportJob:
+    return schemas.ReportJob(id=job.id, status=job.status, spec=job.spec, created_at=job.created_at, cached=job.cached, error=job.error)
+
+@app.post("/profile/reports", response_model=schemas.ReportJob, status_code=202, dependencies=heavy_limit)
+def submit_report(spec: schemas.ReportSpec, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    if spec.category_id is not None and not crud.user_owns_category(db, current_user.id, spec.category_id):
+        raise HTTPException(status_code=400, detail="Invalid category")
+    job = jobs.runner.submit(current_user.id, spec, crud.get_data_version(db, current_user.id))
+    return _job_response(job)
+
+@app.get("/profile/reports/{job_id}", response_model=schemas.ReportJob, dependencies=read_limit)
+def read_report_job(job_id: str, current_user: models.User = Depends(security.get_current_user)):
+    job = jobs.runner.get(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return _job_response(job)
+
+@app.get("/profile/reports/{job_id}/result", response_model=dict, dependencies=read_limit)
+def read_report_result(job_id: str, current_user: models.User = Depends(security.get_current_user)):
+    job = jobs.runner.get(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Report failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail="Report is not ready yet", headers={"Retry-After": "1"})
+    return job.result
+
+@app.get("/profile/categories/{category_id}/transactions", response_model=list[schemas.TransactionRead], dependencies=read_limit)
 def read_category_transactions(category_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user), skip: int = 0, limit: int = 100):
     transactions = crud.get_category_transactions(db, category_id, current_user.id, skip, limit)
     if not transactions and not db.query(models.Category).filter(models.Category.id == category_id, models.Category.user_id == current_user.id).first():
@@ -210,10 +353,43 @@ def read_category_transactions(category_id: int, db: Session = Depends(get_db),
 
 
 
+# --- Budgets ---
+@app.post("/budgets/", response_model=schemas.BudgetRead, dependencies=write_limit)
+def create_budget(budget_in: schemas.BudgetCreate, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    return crud.create_budget(db, current_user.id, budget_in)
+
+@app.get("/profile/budgets", response_model=list[schemas.BudgetStatus], dependencies=read_limit)
+def read_my_budgets(month: Optional[str] = None, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    # month у форматі "YYYY-MM", за замовчуванням — поточний
+    if month is None:
+        month = datetime.utcnow().strftime("%Y-%m")
+    else:
+        try:
+            month = datetime.strptime(month, "%Y-%m").strftime("%Y-%m")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Month must be in YYYY-MM format")
+    return crud.get_budget_statuses(db, current_user.id, month)
+
+@app.put("/budgets/{budget_id}", response_model=schemas.BudgetRead, dependencies=write_limit)
+def update_budget(budget_id: int, budget_in: schemas.BudgetUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    updated = crud.update_budget(db, budget_id, current_user.id, budget_in)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Budget not found or not yours")
+    return updated
+
+@app.delete("/budgets/{budget_id}", status_code=204, dependencies=write_limit)
+def delete_budget(budget_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    deleted = crud.delete_budget(db, budget_id, current_user.id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Budget not found or not yours")
+    return None
+
+
+
 # MKR-1
 # Libraries
 
-@app.post("/libraries/", response_model=schemas.LibraryRead)
+@app.post("/libraries/", response_model=schemas.LibraryRead, dependencies=write_limit)
 def create_library(
     lib_in: schemas.LibraryCreate,
     db: Session = Depends(get_db),
@@ -221,24 +397,41 @@ def create_library(
 ):
     return crud.create_library(db, current_user.id, lib_in)
 
-@app.get("/profile/libraries", response_model=list[schemas.LibraryRead])
+@app.get("/profile/libraries", response_model=list[schemas.LibraryRead], dependencies=read_limit)
 def read_user_libraries(
+    filters: schemas.LibraryFilter = Depends(),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_current_user),
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[str] = None  # ?fields=id,library_name,city
+):
+    selected = crud.parse_fields(schemas.LibraryRead, fields)
+    rows = crud.get_user_libraries(db, current_user.id, filters, skip, limit, selected)
+    if selected is None:
+        return rows
+    return JSONResponse(jsonable_encoder(crud.project(rows, selected)))
+
+@app.get("/profile/libraries/search", response_model=schemas.LibrarySearchResult, dependencies=heavy_limit)
+def search_user_libraries(
     filters: schemas.LibraryFilter = Depends(),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user),
     skip: int = 0,
     limit: int = 100
 ):
-    return crud.get_user_libraries(db, current_user.id, filters, skip, limit)
+    return crud.search_libraries(db, current_user.id, filters, skip, limit)
 
-@app.get("/profile/libraries/stats", response_model=list[schemas.LibraryRead])
+@app.get("/profile/libraries/stats", response_model=schemas.LibraryStats, dependencies=heavy_limit)
 def get_my_library_stats(
+    group_by: Optional[str] = None,  # "city"
+    top: int = 5,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
-    return crud.get_library_stats(db, current_user.id)
+    return crud.get_library_stats(db, current_user.id, group_by, top)
 
-@app.get("/libraries/{library_id}", response_model=schemas.LibraryRead)
+@app.get("/libraries/{library_id}", response_model=schemas.LibraryRead, dependencies=read_limit)
 def read_library(
     library_id: int,
     db: Session = Depends(get_db),
@@ -249,7 +442,7 @@ def read_library(
         raise HTTPException(status_code=404, detail="Library not found or not yours")
     return library
 
-@app.put("/libraries/{library_id}", response_model=schemas.LibraryRead)
+@app.put("/libraries/{library_id}", response_model=schemas.LibraryRead, dependencies=write_limit)
 def update_library(
     library_id: int,
     lib_in: schemas.LibraryUpdate,
@@ -261,7 +454,7 @@ def update_library(
         raise HTTPException(status_code=404, detail="Library not found or not yours")
     return updated
 
-@app.delete("/libraries/{library_id}", status_code=204)
+@app.delete("/libraries/{library_id}", status_code=204, dependencies=write_limit)
 def delete_library(
     library_id: int,
     db: Session = Depends(get_db),
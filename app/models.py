@@ -1,5 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint, Index, event
 from sqlalchemy.orm import relationship
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql import table, column
 from .database import Base
 from datetime import datetime
 
@@ -11,6 +13,7 @@ class User(Base):
     username = Column(String, index=True, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = Column(DateTime, nullable=True)  # акаунт видаляється (дані чистяться пакетами)
 
     categories = relationship("Category", back_populates="user", cascade="all, delete")
     transactions = relationship("Transaction", back_populates="user", cascade="all, delete")
@@ -48,11 +51,49 @@ class Transaction(Base):
     amount = Column(Float, nullable=False)  # +income, -expense
     date = Column(DateTime, default=datetime.utcnow)
     notes = Column(String, nullable=True)
+    external_id = Column(String, nullable=True)  # id у банку/джерелі імпорту
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="transactions")
     category = relationship("Category", back_populates="transactions")
 
+    # AUTOINCREMENT: id не перевикористовуються, тож не конфліктують з архівом
+    __table_args__ = (
+        Index('ix_transactions_user_date', 'user_id', 'date'),
+        # Ідемпотентний імпорт: upsert за (user_id, external_id); NULL-и не конфліктують
+        Index('uix_transactions_user_external', 'user_id', 'external_id', unique=True),
+        {'sqlite_autoincrement': True},
+    )
+
+# Архів ("холодні" транзакції): рядки з date < ArchiveState.cutoff переносяться сюди
+# пакетно (app/archive.py) зі збереженням id. Гаряча таблиця та її індекси лишаються малими.
+class ArchivedTransaction(Base):
+    __tablename__ = "transactions_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
+    title = Column(String)
+    amount = Column(Float, nullable=False)
+    date = Column(DateTime)
+    notes = Column(String, nullable=True)
+    external_id = Column(String, nullable=True)
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_transactions_archive_user_date', 'user_id', 'date'),
+        Index('ix_transactions_archive_category', 'category_id'),
+        Index('ix_transactions_archive_user_external', 'user_id', 'external_id'),
+    )
+
+# Межа архіву та підсумки по ньому для кожного користувача:
+# баланс = сума гарячих + total, без читання архіву
+class ArchiveState(Base):
+    __tablename__ = "archive_state"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    cutoff = Column(DateTime, nullable=False)
+    total = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
 # MKR-1
 # Libraries
 
@@ -70,5 +111,151 @@ class Library(Base):
 
     user = relationship("User", back_populates="libraries")
     __table_args__ = (
+        # Також покриває сортування за назвою (user_id, library_name)
         UniqueConstraint('user_id', 'library_name', 'city', name='uix_user_library_city'),
-    )
\ No newline at end of file
+        # Індекси під фільтр за містом та кожен варіант LibraryFilter.sort_by
+        Index('ix_libraries_user_city', 'user_id', 'city'),
+        Index('ix_libraries_user_books', 'user_id', 'books_amount'),
+        Index('ix_libraries_user_visitors', 'user_id', 'visitors_per_year'),
+        Index('ix_libraries_user_created', 'user_id', 'created_at'),
+    )
+
+
+# Накопичений баланс користувача на початок місяця (сума транзакцій з date < period_end).
+# Створюються ліниво запитами балансу на дату, коригуються при записі транзакцій заднім числом.
+class BalanceCheckpoint(Base):
+    __tablename__ = "balance_checkpoints"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    period_end = Column(DateTime, primary_key=True)
+    balance = Column(Float, nullable=False)
+
+
+# Місячний бюджет на категорію (один на категорію)
+class Budget(Base):
+    __tablename__ = "budgets"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False, unique=True)
+    monthly_limit = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Витрати категорії за місяць ("YYYY-MM"), що підтримуються інкрементально при записі
+# транзакцій — статус бюджетів не перераховує транзакції
+class CategoryMonthSpend(Base):
+    __tablename__ = "category_month_spend"
+    category_id = Column(Integer, ForeignKey("categories.id"), primary_key=True)
+    month = Column(String(7), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    spent = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        Index('ix_category_month_spend_user', 'user_id'),
+    )
+
+
+# Журнал змін для інкрементальної синхронізації (/profile/sync).
+# id — монотонна версія; записується crud-функціями в тій самій транзакції, що й зміна.
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    entity = Column(String, nullable=False)  # "transaction" | "category" | "library"
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # "insert" | "update" | "delete"
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_change_log_user_version', 'user_id', 'id'),
+        Index('ix_change_log_user_entity_version', 'user_id', 'entity', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+# Повнотекстовий (trigram) індекс назв бібліотек — лише SQLite FTS5.
+# Синхронізується тригерами, тому crud нічого додатково не пише.
+libraries_fts = table("libraries_fts", column("rowid"), column("library_name"))
+
+# tokenize='trigram' є з SQLite 3.34; без нього (чи без FTS5) таблицю не створюємо — пошук лишається на ilike
+FTS_TRIGRAM_MIN_VERSION = (3, 34, 0)
+
+def fts_trigram_supported(connection) -> bool:
+    version = connection.exec_driver_sql("SELECT sqlite_version()").scalar()
+    if tuple(int(part) for part in version.split(".")) < FTS_TRIGRAM_MIN_VERSION:
+        return False
+    return bool(connection.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+LIBRARIES_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS libraries_fts USING fts5(
+        library_name, content='libraries', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS libraries_fts_ai AFTER INSERT ON libraries BEGIN
+        INSERT INTO libraries_fts(rowid, library_name) VALUES (new.id, new.library_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS libraries_fts_ad AFTER DELETE ON libraries BEGIN
+        INSERT INTO libraries_fts(libraries_fts, rowid, library_name) VALUES ('delete', old.id, old.library_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS libraries_fts_au AFTER UPDATE OF library_name ON libraries BEGIN
+        INSERT INTO libraries_fts(libraries_fts, rowid, library_name) VALUES ('delete', old.id, old.library_name);
+        INSERT INTO libraries_fts(rowid, library_name) VALUES (new.id, new.library_name);
+    END""",
+]
+
+
+# AUTOINCREMENT задається лише при створенні таблиці, тож стару таблицю без нього
+# перебудовуємо: нова таблиця за моделлю, копія рядків, заміна (індекси створить _sync_schema)
+def _rebuild_autoincrement(connection, tbl):
+    ddl = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tbl.name,)
+    ).scalar()
+    if ddl is None or "AUTOINCREMENT" in ddl.upper():
+        return
+    rebuilt = f"{tbl.name}__rebuild"
+    name = connection.dialect.identifier_preparer.format_table(tbl)
+    create = str(CreateTable(tbl).compile(dialect=connection.dialect))
+    connection.exec_driver_sql(create.replace(f"CREATE TABLE {name} ", f'CREATE TABLE "{rebuilt}" ', 1))
+    existing = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{tbl.name}")')}
+    cols = ", ".join(f'"{col.name}"' for col in tbl.columns if col.name in existing)
+    connection.exec_driver_sql(f'INSERT INTO "{rebuilt}" ({cols}) SELECT {cols} FROM "{tbl.name}"')
+    connection.exec_driver_sql(f'DROP TABLE "{tbl.name}"')
+    connection.exec_driver_sql(f'ALTER TABLE "{rebuilt}" RENAME TO "{tbl.name}"')
+
+
+# create_all не чіпає вже існуючі таблиці, тому нові nullable-колонки, індекси
+# та FTS-таблицю для старих баз створюємо тут
+@event.listens_for(Base.metadata, "after_create")
+def _sync_schema(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        for tbl in target.sorted_tables:
+            existing = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{tbl.name}")')}
+            for col in tbl.columns:
+                if col.name not in existing and col.nullable:
+                    col_type = col.type.compile(dialect=connection.dialect)
+                    connection.exec_driver_sql(f'ALTER TABLE "{tbl.name}" ADD COLUMN "{col.name}" {col_type}')
+            if tbl.dialect_options["sqlite"]["autoincrement"]:
+                _rebuild_autoincrement(connection, tbl)
+
+        # Після перебудови лічильник знає лише id гарячої таблиці, а архівовані id
+        # теж не можна видавати повторно (restore повертає рядок з тим самим id)
+        archived_max = connection.exec_driver_sql("SELECT MAX(id) FROM transactions_archive").scalar()
+        if archived_max is not None:
+            updated = connection.exec_driver_sql(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transactions'", (archived_max,)
+            ).rowcount
+            if not updated:
+                connection.exec_driver_sql(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('transactions', ?)", (archived_max,)
+                )
+
+    for tbl in target.sorted_tables:
+        for index in tbl.indexes:
+            index.create(connection, checkfirst=True)
+
+    if connection.dialect.name != "sqlite" or not fts_trigram_supported(connection):
+        return
+    fts_exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'libraries_fts'"
+    ).first()
+    for ddl in LIBRARIES_FTS_DDL:
+        connection.exec_driver_sql(ddl)
+    if not fts_exists:
+        connection.exec_driver_sql("INSERT INTO libraries_fts(libraries_fts) VALUES ('rebuild')")
\ No newline at end of file
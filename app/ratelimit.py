@@ -0,0 +1,149 @@
+import math
+from threading import Lock
+from time import monotonic
+from typing import Optional
+from fastapi import Depends, HTTPException, Request
+from . import models, security
+
+# Admission control для дорогих ендпоінтів: token bucket на користувача
+# + обмеження одночасних запитів на клас ендпоінтів ("read", "heavy", "write", "stream")
+# і, за потреби, на одного користувача в межах класу (max_per_user).
+# Налаштування — app.state.rate_limits (див. main.py); без нього обмежень немає.
+
+MAX_TRACKED_BUCKETS = 10000
+
+
+class Limit:
+    def __init__(self, rate: float, burst: int, max_concurrency: int, max_per_user: Optional[int] = None):
+        self.rate = rate  # токенів за секунду на користувача
+        self.burst = burst  # місткість відра
+        self.max_concurrency = max_concurrency  # одночасних запитів класу (усі користувачі)
+        self.max_per_user = max_per_user  # одночасних запитів класу одного користувача
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, limit: Limit, now: float) -> None:
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+
+
+class EndpointLimiter:
+    def __init__(self, limit: Limit):
+        self.limit = limit
+        self.buckets: dict[int, TokenBucket] = {}
+        self.in_flight = 0
+        self.user_in_flight: dict[int, int] = {}
+        self.allowed = 0
+        self.rate_limited = 0
+        self.busy = 0
+        self._lock = Lock()
+
+    def acquire(self, user_id: int) -> None:
+        now = monotonic()
+        with self._lock:
+            bucket = self.buckets.get(user_id)
+            if bucket is None:
+                if len(self.buckets) >= MAX_TRACKED_BUCKETS:
+                    self._prune(now)
+                bucket = self.buckets[user_id] = TokenBucket(self.limit.burst, now)
+            else:
+                bucket.refill(self.limit, now)
+
+            if bucket.tokens < 1:
+                self.rate_limited += 1
+                retry_after = (1 - bucket.tokens) / self.limit.rate
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many requests",
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+            if self.limit.max_per_user is not None and self.user_in_flight.get(user_id, 0) >= self.limit.max_per_user:
+                self.rate_limited += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many concurrent requests",
+                    headers={"Retry-After": "1"},
+                )
+            if self.in_flight >= self.limit.max_concurrency:
+                self.busy += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server busy, retry later",
+                    headers={"Retry-After": "1"},
+                )
+            bucket.tokens -= 1
+            self.in_flight += 1
+            self.user_in_flight[user_id] = self.user_in_flight.get(user_id, 0) + 1
+            self.allowed += 1
+
+    def release(self, user_id: int) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            remaining = self.user_in_flight.get(user_id, 0) - 1
+            if remaining > 0:
+                self.user_in_flight[user_id] = remaining
+            else:
+                self.user_in_flight.pop(user_id, None)
+
+    # Повні відра нічого не обмежують — їх можна забути
+    def _prune(self, now: float) -> None:
+        for user_id, bucket in list(self.buckets.items()):
+            bucket.refill(self.limit, now)
+            if bucket.tokens >= self.limit.burst:
+                del self.buckets[user_id]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "rate": self.limit.rate,
+                "burst": self.limit.burst,
+                "max_concurrency": self.limit.max_concurrency,
+                "max_per_user": self.limit.max_per_user,
+                "in_flight": self.in_flight,
+                "allowed": self.allowed,
+                "rejected_rate_limited": self.rate_limited,
+                "rejected_busy": self.busy,
+                "tracked_users": len(self.buckets),
+            }
+
+
+class RateLimits:
+    def __init__(self, limits: dict[str, Limit]):
+        self.limiters = {name: EndpointLimiter(limit) for name, limit in limits.items()}
+
+    def get(self, endpoint_class: str) -> Optional[EndpointLimiter]:
+        return self.limiters.get(endpoint_class)
+
+    def snapshot(self) -> dict:
+        return {name: limiter.snapshot() for name, limiter in self.limiters.items()}
+
+
+# Зайняти місце в класі вручну (для довгих відповідей, що живуть довше за залежність).
+# Повертає limiter, якому треба викликати release(user_id), або None — обмежень немає.
+def acquire(request: Request, endpoint_class: str, user_id: int) -> Optional[EndpointLimiter]:
+    limits: Optional[RateLimits] = getattr(request.app.state, "rate_limits", None)
+    limiter = limits.get(endpoint_class) if limits else None
+    if limiter is not None:
+        limiter.acquire(user_id)
+    return limiter
+
+
+# Залежність для маршруту: dependencies=[Depends(ratelimit.limit("heavy"))]
+def limit(endpoint_class: str):
+    def dependency(request: Request, current_user: models.User = Depends(security.get_current_user)):
+        limiter = acquire(request, endpoint_class, current_user.id)
+        if limiter is None:
+            yield
+            return
+        try:
+            yield
+        finally:
+            limiter.release(current_user.id)
+
+    return dependency
@@ -0,0 +1,262 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from time import monotonic
+from typing import Iterable, Optional
+from .schemas import TransactionFilter
+
+# In-process read model транзакцій "гарячих" користувачів: колонки в array
+# (дати, суми, категорії) + __slots__-записи для тексту, відсортовані за (date, id).
+# Містить лише гарячу таблицю (без архіву). Користувач стає "гарячим" після
+# ADMIT_AFTER списків за ADMIT_WINDOW_SECONDS; тоді модель завантажується,
+# оновлюється crud-функціями (write-through) і витісняється за LRU, коли
+# перевищено MEMORY_BUDGET_BYTES.
+# version — id останнього запису журналу змін по транзакціях, який відображає модель.
+
+ENABLED = True
+MEMORY_BUDGET_BYTES = 64 * 1024 * 1024
+ADMIT_AFTER = 3
+ADMIT_WINDOW_SECONDS = 300
+MAX_TRACKED_CANDIDATES = 10000
+
+ROW_OVERHEAD_BYTES = 5 * 8 + 120  # колонки + TxText з посиланнями
+NO_VALUE = -(2 ** 63)  # None у цілочисельних колонках
+EPOCH = datetime(1970, 1, 1)
+
+
+def _to_micros(dt: Optional[datetime]) -> int:
+    if dt is None:
+        return NO_VALUE
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None)  # як у SQLite: час без зони
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _from_micros(value: int) -> Optional[datetime]:
+    return None if value == NO_VALUE else EPOCH + timedelta(microseconds=value)
+
+
+def _like_pattern(text: str) -> re.Pattern:
+    # Семантика SQL LIKE '%text%': % — будь-який рядок, _ — будь-який символ.
+    # SQLite LIKE ігнорує регістр лише для ASCII ('é' не збігається з 'É') — звідси re.ASCII
+    parts = (".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in text)
+    return re.compile("".join(parts), re.IGNORECASE | re.ASCII | re.DOTALL)
+
+
+class TxText:
+    __slots__ = ("title", "notes", "external_id")
+
+    def __init__(self, title: Optional[str], notes: Optional[str], external_id: Optional[str] = None):
+        self.title = title
+        self.notes = notes
+        self.external_id = external_id
+
+
+# Рядок відповіді — серіалізується в TransactionRead як ORM-об'єкт
+class TxRow:
+    __slots__ = ("id", "user_id", "category_id", "title", "amount", "date", "notes", "external_id", "created_at")
+
+    def __init__(self, id, user_id, category_id, title, amount, date, notes, external_id, created_at):
+        self.id = id
+        self.user_id = user_id
+        self.category_id = category_id
+        self.title = title
+        self.amount = amount
+        self.date = date
+        self.notes = notes
+        self.external_id = external_id
+        self.created_at = created_at
+
+
+class UserTransactions:
+    __slots__ = ("user_id", "version", "ids", "dates", "amounts", "category_ids", "created", "texts", "nbytes")
+
+    def __init__(self, user_id: int, version: int):
+        self.user_id = user_id
+        self.version = version
+        self.ids = array("q")
+        self.dates = array("q")
+        self.amounts = array("d")
+        self.category_ids = array("q")
+        self.created = array("q")
+        self.texts: list[TxText] = []
+        self.nbytes = 0
+
+    @classmethod
+    def build(cls, user_id: int, version: int, rows: Iterable) -> "UserTransactions":
+        model = cls(user_id, version)
+        decoded = sorted(
+            ((_to_micros(row.date), row.id, row) for row in rows),
+            key=lambda item: (item[0], item[1])
+        )
+        for date, tx_id, row in decoded:
+            model._append(date, row)
+        return model
+
+    def _append(self, date: int, row) -> None:
+        self.ids.append(row.id)
+        self.dates.append(date)
+        self.amounts.append(row.amount)
+        self.category_ids.append(NO_VALUE if row.category_id is None else row.category_id)
+        self.created.append(_to_micros(row.created_at))
+        self.texts.append(TxText(row.title, row.notes, row.external_id))
+        self.nbytes += self._row_bytes(self.texts[-1])
+
+    @staticmethod
+    def _row_bytes(text: TxText) -> int:
+        return ROW_OVERHEAD_BYTES + len(text.title or "") + len(text.notes or "") + len(text.external_id or "")
+
+    def _position(self, tx_id: int) -> int:
+        # Позиція за id: лінійний пошук у C-масиві — достатньо швидко для рідкісних змін
+        try:
+            return self.ids.index(tx_id)
+        except ValueError:
+            return -1
+
+    def upsert(self, row) -> None:
+        self.remove(row.id)
+        date = _to_micros(row.date)
+        # Вставка з урахуванням порядку (date, id)
+        pos = bisect_right(self.dates, date)
+        while pos > 0 and self.dates[pos - 1] == date and self.ids[pos - 1] > row.id:
+            pos -= 1
+        self.ids.insert(pos, row.id)
+        self.dates.insert(pos, date)
+        self.amounts.insert(pos, row.amount)
+        self.category_ids.insert(pos, NO_VALUE if row.category_id is None else row.category_id)
+        self.created.insert(pos, _to_micros(row.created_at))
+        self.texts.insert(pos, TxText(row.title, row.notes, row.external_id))
+        self.nbytes += self._row_bytes(self.texts[pos])
+
+    def remove(self, tx_id: int) -> None:
+        pos = self._position(tx_id)
+        if pos < 0:
+            return
+        self.nbytes -= self._row_bytes(self.texts[pos])
+        for column in (self.ids, self.dates, self.amounts, self.category_ids, self.created, self.texts):
+            del column[pos]
+
+    def _row(self, pos: int) -> TxRow:
+        category_id = self.category_ids[pos]
+        text = self.texts[pos]
+        return TxRow(
+            self.ids[pos], self.user_id, None if category_id == NO_VALUE else category_id,
+            text.title, self.amounts[pos], _from_micros(self.dates[pos]), text.notes,
+            text.external_id, _from_micros(self.created[pos]),
+        )
+
+    # Те саме, що crud.get_user_transactions: фільтри, сортування date desc, skip/limit
+    def query(self, filters: TransactionFilter, skip: int = 0, limit: int = 100) -> list[TxRow]:
+        lo = bisect_left(self.dates, _to_micros(filters.start_date)) if filters.start_date else 0
+        hi = bisect_right(self.dates, _to_micros(filters.end_date)) if filters.end_date else len(self.dates)
+        if filters.start_date or filters.end_date:
+            lo = max(lo, bisect_right(self.dates, NO_VALUE))  # NULL-дати не проходять фільтр за датою
+        category_id = filters.category_id
+        min_amount, max_amount = filters.min_amount, filters.max_amount
+        title = _like_pattern(filters.title) if filters.title else None
+
+        result = []
+        wanted = skip + limit
+        amounts, category_ids, texts = self.amounts, self.category_ids, self.texts
+        for pos in range(hi - 1, lo - 1, -1):
+            if category_id is not None and category_ids[pos] != category_id:
+                continue
+            if min_amount is not None and amounts[pos] < min_amount:
+                continue
+            if max_amount is not None and amounts[pos] > max_amount:
+                continue
+            if title is not None and (texts[pos].title is None or not title.search(texts[pos].title)):
+                continue
+            result.append(pos)
+            if len(result) >= wanted:
+                break
+        return [self._row(pos) for pos in result[skip:]]
+
+
+class ReadModelStore:
+    def __init__(self, budget_bytes: int = MEMORY_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._users: OrderedDict[int, UserTransactions] = OrderedDict()
+        self._bytes = 0
+        self._candidates: OrderedDict[int, tuple[float, int]] = OrderedDict()  # user_id -> (початок вікна, списків)
+        self._lock = Lock()
+
+    # Облік списку користувача, якого ще немає в моделі; True — час завантажувати
+    def admit(self, user_id: int) -> bool:
+        now = monotonic()
+        with self._lock:
+            started, count = self._candidates.pop(user_id, (now, 0))
+            if now - started > ADMIT_WINDOW_SECONDS:
+                started, count = now, 0
+            count += 1
+            if count >= ADMIT_AFTER:
+                return True
+            self._candidates[user_id] = (started, count)
+            while len(self._candidates) > MAX_TRACKED_CANDIDATES:
+                self._candidates.popitem(last=False)
+            return False
+
+    # None — моделі немає або вона застаріла (version не збігається): треба put() нову
+    def query(self, user_id: int, version: int, filters: TransactionFilter, skip: int = 0, limit: int = 100) -> Optional[list[TxRow]]:
+        with self._lock:
+            model = self._users.get(user_id)
+            if model is None or model.version != version:
+                return None
+            self._users.move_to_end(user_id)
+            return model.query(filters, skip, limit)
+
+    def version_of(self, user_id: int) -> Optional[int]:
+        with self._lock:
+            model = self._users.get(user_id)
+            return model.version if model is not None else None
+
+    def put(self, model: UserTransactions) -> bool:
+        if model.nbytes > self.budget_bytes:
+            return False  # один користувач не поміщається — лишаємо SQL
+        with self._lock:
+            old = self._users.pop(model.user_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._users[model.user_id] = model
+            self._bytes += model.nbytes
+            self._evict()
+        return True
+
+    # Write-through: застосувати зміну, якщо модель була актуальна до неї
+    def apply(self, user_id: int, previous_version: int, version: int, row=None, deleted_id: Optional[int] = None) -> None:
+        with self._lock:
+            model = self._users.get(user_id)
+            if model is None:
+                return
+            if model.version != previous_version:
+                self._drop(user_id)
+                return
+            before = model.nbytes
+            if row is not None:
+                model.upsert(row)
+            if deleted_id is not None:
+                model.remove(deleted_id)
+            model.version = version
+            self._bytes += model.nbytes - before
+            self._evict()
+
+    def evict(self, user_id: int) -> None:
+        with self._lock:
+            self._drop(user_id)
+
+    def _drop(self, user_id: int) -> None:
+        model = self._users.pop(user_id, None)
+        if model is not None:
+            self._bytes -= model.nbytes
+
+    def _evict(self) -> None:
+        while self._bytes > self.budget_bytes and self._users:
+            _, model = self._users.popitem(last=False)
+            self._bytes -= model.nbytes
+
+
+store = ReadModelStore()
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# Спільний для всіх воркерів кеш серіалізованих відповідей (SQLite-файл у WAL-режимі).
+# Ключ — (user_id, key); кожен запис несе version — версію даних користувача
+# (crud.get_data_version), для якої він зібраний. Версія пишеться в журнал змін
+# у тій самій транзакції, що й зміна, тож запис валідний лише при точному збігу:
+# будь-яка зміна в будь-якому воркері робить його застарілим без явної інвалідації.
+# Помилки SQLite (lock, диск) — просто промах: кеш не має ламати запити.
+
+PATH = "./response_cache.db"
+ENABLED = True
+MAX_ENTRIES = 10000
+PRUNE_EVERY = 500  # записів put між перевірками розміру
+BUSY_TIMEOUT_SECONDS = 0.5
+
+
+class ResponseCache:
+    def __init__(self, path: str = PATH, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " user_id INTEGER NOT NULL,"
+                " key TEXT NOT NULL,"
+                " version INTEGER NOT NULL,"
+                " body BLOB NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " PRIMARY KEY (user_id, key))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, user_id: int, key: str, version: int) -> Optional[bytes]:
+        try:
+            row = self._connect().execute(
+                "SELECT body FROM responses WHERE user_id = ? AND key = ? AND version = ?",
+                (user_id, key, version),
+            ).fetchone()
+        except sqlite3.Error:
+            row = None
+        self._count(row is not None)
+        return row[0] if row is not None else None
+
+    # Старішу версію не записуємо поверх новішої (воркери можуть фінішувати не по черзі)
+    def put(self, user_id: int, key: str, version: int, body: bytes) -> None:
+        try:
+            self._connect().execute(
+                "INSERT INTO responses (user_id, key, version, body, stored_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, key) DO UPDATE SET "
+                " version = excluded.version, body = excluded.body, stored_at = excluded.stored_at "
+                "WHERE excluded.version >= responses.version",
+                (user_id, key, version, body, time.time()),
+            )
+        except sqlite3.Error:
+            return
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def invalidate(self, user_id: int) -> None:
+        try:
+            self._connect().execute("DELETE FROM responses WHERE user_id = ?", (user_id,))
+        except sqlite3.Error:
+            pass
+
+    # Лишаємо max_entries найсвіжіших записів
+    def prune(self) -> None:
+        try:
+            self._connect().execute(
+                "DELETE FROM responses WHERE rowid IN ("
+                " SELECT rowid FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        except sqlite3.Error:
+            pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+responses = ResponseCache()
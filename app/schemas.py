@@ -76,6 +76,7 @@ class TransactionRead(BaseModel):
     amount: float
     date: datetime
     notes: Optional[str]
+    external_id: Optional[str] = None
     created_at: datetime
 
     class Config:
@@ -110,6 +111,7 @@ class BalanceRead(BaseModel):
     balance: float
     currency: str = "USD"  # За замовчуванням, можна зробити конфігурацією
     updated_at: datetime
+    as_of: Optional[datetime] = None  # баланс на дату, якщо запитано
 
     class Config:
         from_attributes = True
@@ -173,10 +175,166 @@ class LibraryFilter(BaseModel):
     sort_order: Optional[str] = "desc"  # "asc" or "desc"
 
 
+class CityFacet(BaseModel):
+    city: str
+    count: int
+
+
+class LibrarySearchResult(BaseModel):
+    items: list[LibraryRead]
+    total: int
+    city_facets: list[CityFacet]  # рахуються без урахування фільтра city
+
+
+class LibraryCityStats(BaseModel):
+    city: str
+    total_libraries: int
+    total_books: int
+    total_visitors: int
+    avg_books: float
+    avg_visitors: float
+
+
 class LibraryStats(BaseModel):
     total_libraries: int
     total_books: int
     total_visitors: int
+    avg_books: float = 0.0
+    avg_visitors: float = 0.0
+    by_city: Optional[list[LibraryCityStats]] = None  # лише для group_by=city
+    top_libraries: list[LibraryRead] = []
+
+
+# ---- Budgets ----
+class BudgetCreate(BaseModel):
+    category_id: int
+    monthly_limit: float
+
+    @field_validator("monthly_limit")
+    @classmethod
+    def positive_limit(cls, v):
+        if v <= 0:
+            raise ValueError("Ліміт бюджету має бути більшим за нуль")
+        return v
+
+class BudgetUpdate(BaseModel):
+    monthly_limit: float
+
+    @field_validator("monthly_limit")
+    @classmethod
+    def positive_limit(cls, v):
+        if v <= 0:
+            raise ValueError("Ліміт бюджету має бути більшим за нуль")
+        return v
+
+class BudgetRead(BaseModel):
+    id: int
+    user_id: int
+    category_id: int
+    monthly_limit: float
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class BudgetStatus(BaseModel):
+    budget_id: int
+    category_id: int
+    category_name: str
+    month: str  # "YYYY-MM"
+    monthly_limit: float
+    spent: float
+    remaining: float
+    percent_used: float
+
+
+# ---- Import (банківська синхронізація) ----
+class TransactionImport(BaseModel):
+    external_id: str
+    title: Optional[str] = None
+    amount: float
+    category_id: Optional[int] = None
+    date: datetime  # обов'язкова: інакше повторний імпорт змінював би дату
+    notes: Optional[str] = None
+
+    @field_validator("external_id")
+    @classmethod
+    def valid_external_id(cls, v):
+        v = v.strip()
+        if not v or len(v) > 200:
+            raise ValueError("external_id має містити від 1 до 200 символів")
+        return v
+
+class TransactionImportItem(BaseModel):
+    external_id: str
+    id: int
+    status: str  # "inserted" | "updated" | "unchanged"
+
+class TransactionImportResult(BaseModel):
+    inserted: int
+    updated: int
+    unchanged: int
+    items: list[TransactionImportItem]
+
+
+# ---- Sync ----
+class CategorySyncRead(BaseModel):
+    id: int
+    name: str
+    user_id: int
+    parent_id: Optional[int]
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class SyncChanges(BaseModel):
+    transactions: list[TransactionRead] = []
+    categories: list[CategorySyncRead] = []
+    libraries: list[LibraryRead] = []
+
+class SyncDeleted(BaseModel):
+    transactions: list[int] = []
+    categories: list[int] = []
+    libraries: list[int] = []
+
+class SyncResponse(BaseModel):
+    version: int  # передати як since у наступному запиті
+    full: bool  # True — повний знімок, клієнт замінює локальні дані
+    has_more: bool
+    changes: SyncChanges
+    deleted: SyncDeleted
+
+
+# ---- Reports ----
+class ReportSpec(BaseModel):
+    start_year: int
+    end_year: int
+    category_id: Optional[int] = None
+    by_category: bool = False
+
+    @field_validator("start_year", "end_year")
+    @classmethod
+    def valid_year(cls, v):
+        if not 1900 <= v <= 2999:
+            raise ValueError("Рік має бути між 1900 та 2999")
+        return v
+
+    @field_validator("end_year")
+    @classmethod
+    def valid_range(cls, v, info):
+        start = info.data.get("start_year")
+        if start is not None and not 0 <= v - start < 50:
+            raise ValueError("Діапазон років має бути від 1 до 50 років")
+        return v
+
+class ReportJob(BaseModel):
+    id: str
+    status: str  # "pending" | "done" | "failed"
+    spec: ReportSpec
+    created_at: datetime
+    cached: bool = False
+    error: Optional[str] = None
 
 
 # Оновлюємо рекурсію
@@ -0,0 +1,152 @@
+# Бенчмарк спільного кешу дерева категорій (app/responsecache.py) на кількох процесах.
+#
+#   python benchmarks/bench_category_cache.py [--workers 4] [--users 40] [--requests 400]
+#
+# Кожен процес — окремий "воркер" зі своїм engine і своїм з'єднанням до кешу.
+# Воркери читають дерево випадкових користувачів і з імовірністю --write-ratio
+# додають транзакцію (ця зміна має інвалідувати кеш для всіх процесів).
+# Дві фази: без кешу (ENABLED = False) і з кешем; наприкінці — перевірка,
+# що кожен актуальний запис кешу збігається з щойно побудованим деревом.
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from statistics import mean, quantiles
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import crud, models, responsecache, schemas
+
+
+def seed(url: str, users: int, categories: int, transactions: int) -> dict[int, list[int]]:
+    engine = create_engine(url)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    start = datetime(2024, 1, 1)
+    owned = {}
+    for u in range(users):
+        user = models.User(email=f"user{u}@example.com", hashed_password="x", username=f"user{u}")
+        db.add(user)
+        db.flush()
+        cats = []
+        for c in range(categories):
+            cat = models.Category(user_id=user.id, name=f"c{c}", parent_id=cats[c // 3].id if c >= 3 else None)
+            db.add(cat)
+            db.flush()
+            cats.append(cat)
+        db.add_all(
+            models.Transaction(
+                user_id=user.id, category_id=cats[i % categories].id, title=f"t{i}",
+                amount=float(i % 300 - 150), date=start + timedelta(hours=i), notes="note " * 4
+            )
+            for i in range(transactions)
+        )
+        db.add(models.ChangeLog(user_id=user.id, entity="category", entity_id=cats[-1].id, op="insert"))
+        owned[user.id] = [cat.id for cat in cats]
+    db.commit()
+    db.close()
+    engine.dispose()
+    return owned
+
+
+def worker(args: tuple) -> dict:
+    url, cache_path, enabled, owned, requests, write_ratio, seed_value = args
+    responsecache.ENABLED = enabled
+    responsecache.responses = responsecache.ResponseCache(cache_path)
+    engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+    db = sessionmaker(bind=engine)()
+    rng = random.Random(seed_value)
+    user_ids = list(owned)
+
+    latencies = []
+    writes = 0
+    for i in range(requests):
+        user_id = rng.choice(user_ids)
+        if rng.random() < write_ratio:
+            crud.create_transaction(db, user_id, schemas.TransactionCreate(
+                title=f"w{seed_value}-{i}", amount=1.0, category_id=rng.choice(owned[user_id])
+            ))
+            writes += 1
+            continue
+        start = perf_counter()
+        crud.get_user_categories_json(db, user_id)
+        latencies.append((perf_counter() - start) * 1000)
+        db.rollback()  # як кінець запиту: наступний читає свіжий стан
+    db.close()
+    engine.dispose()
+    return {"latencies": latencies, "writes": writes, **responsecache.responses.snapshot()}
+
+
+def run_phase(name: str, pool, url: str, cache_path: str, enabled: bool, owned, args) -> None:
+    jobs = [
+        (url, cache_path, enabled, owned, args.requests, args.write_ratio, n)
+        for n in range(args.workers)
+    ]
+    start = perf_counter()
+    results = pool.map(worker, jobs)
+    elapsed = perf_counter() - start
+
+    latencies = [ms for result in results for ms in result["latencies"]]
+    hits = sum(result["hits"] for result in results)
+    misses = sum(result["misses"] for result in results)
+    writes = sum(result["writes"] for result in results)
+    cuts = quantiles(latencies, n=100)
+    p50, p95 = cuts[49], cuts[94]
+    hit_rate = f"{hits / (hits + misses):.1%}" if enabled else "-"
+    print(
+        f"{name:<10}{len(latencies):>7}{writes:>7}{hit_rate:>10}"
+        f"{mean(latencies):>10.2f}{p50:>9.2f}{p95:>9.2f}{len(latencies) / elapsed:>11.0f}"
+    )
+
+
+def verify(url: str, cache_path: str, owned) -> int:
+    engine = create_engine(url)
+    db = sessionmaker(bind=engine)()
+    cache = responsecache.ResponseCache(cache_path)
+    checked = 0
+    for user_id in owned:
+        body = cache.get(user_id, "categories", crud.get_data_version(db, user_id))
+        if body is None:
+            continue
+        fresh = crud.JSON_ADAPTER.dump_json(crud.get_user_categories(db, user_id))
+        assert body == fresh, f"stale cache entry for user {user_id}"
+        checked += 1
+    engine.dispose()
+    return checked
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--categories", type=int, default=15)
+    parser.add_argument("--transactions", type=int, default=300, help="per user")
+    parser.add_argument("--requests", type=int, default=400, help="per worker")
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    cache_path = os.path.join(tmp, "response_cache.db")
+    owned = seed(url, args.users, args.categories, args.transactions)
+
+    print(
+        f"{args.workers} workers x {args.requests} requests, {args.users} users, "
+        f"{args.categories} categories and {args.transactions} transactions per user, "
+        f"write ratio {args.write_ratio}; latency in ms"
+    )
+    print(f"{'phase':<10}{'reads':>7}{'writes':>7}{'hit rate':>10}{'mean':>10}{'p50':>9}{'p95':>9}{'reads/s':>11}")
+    with multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+        run_phase("no cache", pool, url, cache_path, False, owned, args)
+        run_phase("cache", pool, url, cache_path, True, owned, args)
+    print(f"verified {verify(url, cache_path, owned)} cached trees against fresh builds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# Мікробенчмарк гарячих crud-запитів: db.query(...) ланцюжки, lambda_stmt
+# і готові statement'и з bindparam (поточна реалізація crud).
+#
+#   python benchmarks/bench_statements.py [--calls 2000] [--transactions 2000]
+#
+# Заміри на виклик:
+#   query/no cache — db.query(...) при query_cache_size=0 (компіляція на кожен виклик)
+#   query/cached   — db.query(...) зі стандартним кешем (будується statement + cache key)
+#   lambda_stmt    — той самий запит через lambda_stmt
+#   crud           — поточна реалізація crud (statement будується один раз)
+# compile = no cache - cached; speedup = query/cached / crud.
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, lambda_stmt, select
+from sqlalchemy.orm import sessionmaker
+from app import crud, models, readmodel
+from app.schemas import TransactionFilter
+
+
+# Реалізації до переходу на готові statement'и
+def query_get_user_by_email(db, email):
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def query_get_category(db, category_id, user_id):
+    return db.query(models.Category).filter(models.Category.id == category_id, models.Category.user_id == user_id).first()
+
+def query_get_user_transactions(db, user_id, filters, skip, limit):
+    query = db.query(models.Transaction).filter(models.Transaction.user_id == user_id)
+    if filters.min_amount is not None:
+        query = query.filter(models.Transaction.amount >= filters.min_amount)
+    if filters.title:
+        query = query.filter(models.Transaction.title.ilike(f"%{filters.title}%"))
+    return query.order_by(models.Transaction.date.desc()).offset(skip).limit(limit).all()
+
+def query_get_user_balance(db, user_id):
+    total = db.query(func.coalesce(func.sum(models.Transaction.amount), 0.0)).filter(models.Transaction.user_id == user_id).scalar()
+    state = crud.get_archive_state(db, user_id)
+    return float(total) + (state.total if state else 0.0)
+
+def query_get_data_version(db, user_id, entity):
+    return db.query(func.max(models.ChangeLog.id)).filter(
+        models.ChangeLog.user_id == user_id, models.ChangeLog.entity == entity
+    ).scalar() or 0
+
+
+# Ті самі запити через lambda_stmt
+def lambda_get_user_by_email(db, email):
+    return db.execute(lambda_stmt(lambda: select(models.User).where(models.User.email == email).limit(1))).scalars().first()
+
+def lambda_get_category(db, category_id, user_id):
+    return db.execute(lambda_stmt(lambda: select(models.Category).where(
+        models.Category.id == category_id, models.Category.user_id == user_id
+    ).limit(1))).scalars().first()
+
+def lambda_get_user_transactions(db, user_id, filters, skip, limit):
+    stmt = lambda_stmt(lambda: select(models.Transaction).where(models.Transaction.user_id == user_id))
+    min_amount = filters.min_amount
+    if min_amount is not None:
+        stmt += lambda s: s.where(models.Transaction.amount >= min_amount)
+    if filters.title:
+        pattern = f"%{filters.title}%"
+        stmt += lambda s: s.where(models.Transaction.title.ilike(pattern))
+    stmt += lambda s: s.order_by(models.Transaction.date.desc()).offset(skip).limit(limit)
+    return db.execute(stmt).scalars().all()
+
+def lambda_get_user_balance(db, user_id):
+    total = db.execute(lambda_stmt(lambda: select(func.coalesce(func.sum(models.Transaction.amount), 0.0)).where(
+        models.Transaction.user_id == user_id
+    ))).scalar()
+    state = crud.get_archive_state(db, user_id)
+    return float(total) + (state.total if state else 0.0)
+
+def lambda_get_data_version(db, user_id, entity):
+    return db.execute(lambda_stmt(lambda: select(func.max(models.ChangeLog.id)).where(
+        models.ChangeLog.user_id == user_id, models.ChangeLog.entity == entity
+    ))).scalar() or 0
+
+
+def seed(url: str, transactions: int) -> tuple[int, str, int]:
+    engine = create_engine(url)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = models.User(email="bench@example.com", hashed_password="x", username="bench")
+    db.add(user)
+    db.flush()
+    categories = [models.Category(user_id=user.id, name=f"c{i}") for i in range(20)]
+    db.add_all(categories)
+    db.flush()
+    start = datetime(2024, 1, 1)
+    db.add_all(
+        models.Transaction(
+            user_id=user.id, category_id=categories[i % 20].id, title=f"t{i}",
+            amount=float(i % 500), date=start + timedelta(hours=i)
+        )
+        for i in range(transactions)
+    )
+    db.add_all(
+        models.ChangeLog(user_id=user.id, entity="transaction", entity_id=i + 1, op="insert")
+        for i in range(transactions)
+    )
+    db.commit()
+    result = (user.id, user.email, categories[0].id)
+    db.close()
+    engine.dispose()
+    return result
+
+
+def per_call(fn, calls: int) -> float:
+    fn()  # прогрів (перша компіляція)
+    start = perf_counter()
+    for _ in range(calls):
+        fn()
+    return (perf_counter() - start) / calls * 1e6  # мкс
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--transactions", type=int, default=2000)
+    args = parser.parse_args()
+
+    readmodel.ENABLED = False  # міряємо SQL-шлях списку транзакцій
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    url = f"sqlite:///{path}"
+    user_id, email, category_id = seed(url, args.transactions)
+
+    no_cache = sessionmaker(bind=create_engine(url, query_cache_size=0))()
+    cached = sessionmaker(bind=create_engine(url))()
+    filters = TransactionFilter(min_amount=100, title="1")
+
+    # (назва, db.query, lambda_stmt, crud)
+    cases = [
+        ("user lookup",
+         lambda db: query_get_user_by_email(db, email),
+         lambda db: lambda_get_user_by_email(db, email),
+         lambda db: crud.get_user_by_email(db, email)),
+        ("category lookup",
+         lambda db: query_get_category(db, category_id, user_id),
+         lambda db: lambda_get_category(db, category_id, user_id),
+         lambda db: crud.get_category(db, category_id, user_id)),
+        ("transaction listing",
+         lambda db: query_get_user_transactions(db, user_id, filters, 0, 20),
+         lambda db: lambda_get_user_transactions(db, user_id, filters, 0, 20),
+         lambda db: crud.get_user_transactions(db, user_id, filters, 0, 20)),
+        ("balance",
+         lambda db: query_get_user_balance(db, user_id),
+         lambda db: lambda_get_user_balance(db, user_id),
+         lambda db: crud.get_user_balance(db, user_id)),
+        ("data version",
+         lambda db: query_get_data_version(db, user_id, "transaction"),
+         lambda db: lambda_get_data_version(db, user_id, "transaction"),
+         lambda db: crud.get_data_version(db, user_id, "transaction")),
+    ]
+
+    print(f"{args.calls} calls per case, {args.transactions} transactions, times in µs/call")
+    print(f"{'path':<22}{'query/no cache':>16}{'query/cached':>14}{'lambda_stmt':>13}{'crud':>9}{'compile':>10}{'speedup':>9}")
+    for name, legacy, with_lambda, current in cases:
+        uncached_us = per_call(lambda: legacy(no_cache), args.calls)
+        cached_us = per_call(lambda: legacy(cached), args.calls)
+        lambda_us = per_call(lambda: with_lambda(cached), args.calls)
+        crud_us = per_call(lambda: current(cached), args.calls)
+        print(
+            f"{name:<22}{uncached_us:>16.1f}{cached_us:>14.1f}{lambda_us:>13.1f}{crud_us:>9.1f}"
+            f"{uncached_us - cached_us:>10.1f}{cached_us / crud_us:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()